@@ -5,103 +5,354 @@ PandocConverter 插件安装脚本
 用于检查依赖、配置环境并初始化插件
 """
 
+import importlib.util
+import io
 import os
+import shlex
 import sys
 import subprocess
 import json
 import shutil
-from pathlib import Path
+import stat
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 版本探测结果缓存，按可执行文件路径及其mtime失效
+PROBE_CACHE_FILE = ".install_cache.json"
+_probe_cache = None
+_probe_cache_lock = threading.Lock()
+PROBE_MARKER = "@@@PROBE "
+# 已确认存在的可执行文件通常立即响应，超时后再以较长时间重试一次以应对冷启动
+PROBE_TIMEOUT = 2
+PROBE_RETRY_TIMEOUT = 5
+
+USAGE_INFO = """
+==================================================
+安装完成！
+==================================================
+
+使用说明:
+1. 确保分布式服务器已启动
+2. 插件将自动注册到VCP系统
+3. AI可以使用以下命令调用插件:
+   - ConvertFile: 转换单个文件
+   - BatchConvert: 批量转换文件
+   - ConvertFromContent: 从内容转换
+   - DetectFormat: 检测文件格式
+   - GetSupportedFormats: 获取支持格式
+
+配置文件: config.env
+输出目录: outputs/
+临时文件: temp/
+
+更多信息请参考 README.md
+"""
+
+def _is_interactive():
+    """标准输入输出是否都连接到终端"""
+    return sys.stdin.isatty() and sys.stdout.isatty()
 
 def check_python_version():
     """检查Python版本"""
     print("检查Python版本...")
     version = sys.version_info
-    if version.major < 3 or (version.major == 3 and version.minor < 7):
-        print("✗ Python版本过低: {}.{}".format(version.major, version.minor))
+    if version[:2] < (3, 7):
+        print(f"✗ Python版本过低: {version.major}.{version.minor}")
         print("  需要Python 3.7或更高版本")
         return False
     else:
-        print("✓ Python版本: {}.{}.{}".format(version.major, version.minor, version.micro))
+        print(f"✓ Python版本: {version.major}.{version.minor}.{version.micro}")
         return True
 
-def check_pandoc():
+def _load_probe_cache():
+    """读取版本探测缓存"""
+    global _probe_cache
+    if _probe_cache is None:
+        try:
+            with open(PROBE_CACHE_FILE, 'r', encoding='utf-8') as f:
+                _probe_cache = json.load(f)
+        except (OSError, ValueError):
+            _probe_cache = {}
+    return _probe_cache
+
+def _save_probe_cache(cache):
+    """原子地写回版本探测缓存"""
+    fd, tmp_path = tempfile.mkstemp(dir=".", prefix=PROBE_CACHE_FILE + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, PROBE_CACHE_FILE)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _lookup_probe(cmd):
+    """查找探测缓存，返回 (缓存键, mtime_ns, 命中的缓存项或None)
+    
+    找不到可执行文件时抛出FileNotFoundError。
+    """
+    path = shutil.which(cmd[0])
+    if path is None:
+        raise FileNotFoundError(cmd[0])
+    key = " ".join([path] + list(cmd[1:]))
+    mtime_ns = os.stat(path).st_mtime_ns
+    
+    with _probe_cache_lock:
+        entry = _load_probe_cache().get(key)
+    if entry and entry.get('mtime_ns') == mtime_ns:
+        return key, mtime_ns, entry
+    return key, mtime_ns, None
+
+def _store_probes(probes):
+    """写入探测结果，probes为 [(缓存键, mtime_ns, returncode, 输出首行)]
+    
+    只缓存成功的探测：失败可能由之后会修复的环境问题引起，下次运行时应重新探测。
+    """
+    succeeded = [probe for probe in probes if probe[2] == 0]
+    if not succeeded:
+        return
+    with _probe_cache_lock:
+        cache = _load_probe_cache()
+        for key, mtime_ns, returncode, output in succeeded:
+            cache[key] = {
+                'mtime_ns': mtime_ns,
+                'returncode': returncode,
+                'output': output
+            }
+        _save_probe_cache(cache)
+
+def _run_probe(args):
+    """运行探测命令，首次超时后以更长的超时重试一次"""
+    try:
+        return subprocess.run(args, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return subprocess.run(args, capture_output=True, text=True, timeout=PROBE_RETRY_TIMEOUT)
+
+def _probe_cached(cmd):
+    """运行版本探测命令，返回 (returncode, 输出首行)
+    
+    可执行文件未变化时直接复用上次的结果，找不到时抛出FileNotFoundError。
+    """
+    key, mtime_ns, entry = _lookup_probe(cmd)
+    if entry:
+        return entry['returncode'], entry['output']
+    
+    result = _run_probe([shutil.which(cmd[0])] + list(cmd[1:]))
+    output = result.stdout.split('\n')[0]
+    _store_probes([(key, mtime_ns, result.returncode, output)])
+    return result.returncode, output
+
+def _probe_batched(paths):
+    """POSIX下在同一个sh进程中依次运行各可执行文件的 --version，返回 {路径: returncode}
+    
+    超时或未能探测的路径不出现在结果中。
+    """
+    results = {}
+    pending = []
+    for path in paths:
+        try:
+            key, mtime_ns, entry = _lookup_probe([path, "--version"])
+        except FileNotFoundError:
+            continue
+        if entry:
+            results[path] = entry['returncode']
+        else:
+            pending.append((path, key, mtime_ns))
+    if not pending:
+        return results
+    
+    # 每个探测后输出带序号和退出码的标记行，据此拆分各自的输出
+    script = "; ".join(
+        f'{shlex.quote(path)} --version 2>/dev/null; rc=$?; printf "\\n{PROBE_MARKER}%d %d\\n" {index} $rc'
+        for index, (path, _, _) in enumerate(pending)
+    )
+    try:
+        result = _run_probe(["/bin/sh", "-c", script])
+    except subprocess.TimeoutExpired:
+        return results
+    
+    probes = []
+    lines = []
+    for line in result.stdout.splitlines():
+        if line.startswith(PROBE_MARKER):
+            index, returncode = (int(x) for x in line[len(PROBE_MARKER):].split())
+            path, key, mtime_ns = pending[index]
+            results[path] = returncode
+            output = next((l for l in lines if l.strip()), "")
+            probes.append((key, mtime_ns, returncode, output))
+            lines = []
+        else:
+            lines.append(line)
+    if probes:
+        _store_probes(probes)
+    return results
+
+def check_pandoc(out=None):
     """检查Pandoc是否安装"""
-    print("\n检查Pandoc...")
+    out = out or sys.stdout
+    print("\n检查Pandoc...", file=out)
+    # 先在PATH中查找，未安装时无需启动子进程
+    pandoc_path = shutil.which("pandoc")
+    if pandoc_path is None:
+        print("✗ Pandoc未安装或不在PATH中", file=out)
+        print("  请从 https://pandoc.org/installing.html 下载安装", file=out)
+        return False
     try:
-        result = subprocess.run(
-            ["pandoc", "--version"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        if result.returncode == 0:
-            version_line = result.stdout.split('\n')[0]
-            print("✓ Pandoc已安装: {}".format(version_line))
+        returncode, version_line = _probe_cached([pandoc_path, "--version"])
+        if returncode == 0:
+            print(f"✓ Pandoc已安装: {version_line}", file=out)
             return True
         else:
-            print("✗ Pandoc未正确安装")
+            print("✗ Pandoc未正确安装", file=out)
             return False
     except (subprocess.TimeoutExpired, FileNotFoundError):
-        print("✗ Pandoc未安装或不在PATH中")
-        print("  请从 https://pandoc.org/installing.html 下载安装")
+        print("✗ Pandoc未安装或不在PATH中", file=out)
+        print("  请从 https://pandoc.org/installing.html 下载安装", file=out)
+        return False
+
+def _probe_engine(engine_path):
+    """探测单个LaTeX引擎是否可用"""
+    try:
+        returncode, _ = _probe_cached([engine_path, "--version"])
+        return returncode == 0
+    except (subprocess.TimeoutExpired, FileNotFoundError):
         return False
 
-def check_latex():
+def check_latex(out=None):
     """检查LaTeX发行版（PDF生成需要）"""
-    print("\n检查LaTeX发行版...")
+    out = out or sys.stdout
+    print("\n检查LaTeX发行版...", file=out)
     engines = ["xelatex", "pdflatex", "lualatex"]
-    found_engines = []
     
-    for engine in engines:
-        try:
-            result = subprocess.run(
-                [engine, "--version"],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                found_engines.append(engine)
-        except (subprocess.TimeoutExpired, FileNotFoundError):
-            pass
+    # 只探测PATH中存在的引擎
+    engine_paths = {engine: shutil.which(engine) for engine in engines}
+    engine_paths = {engine: path for engine, path in engine_paths.items() if path}
+    
+    if engine_paths and os.name == 'posix':
+        # POSIX下合并到一个sh进程中探测，只需一次fork
+        returncodes = _probe_batched(list(engine_paths.values()))
+        usable = {engine: returncodes.get(path) == 0 for engine, path in engine_paths.items()}
+    elif engine_paths:
+        # 其他平台并行探测各引擎，总耗时取决于最慢的一个
+        with ThreadPoolExecutor(max_workers=len(engine_paths)) as executor:
+            usable = dict(zip(engine_paths, executor.map(_probe_engine, engine_paths.values())))
+    else:
+        usable = {}
+    
+    # 按固定顺序输出，避免结果顺序随完成时间变化
+    found_engines = [engine for engine in engines if usable.get(engine)]
     
     if found_engines:
-        print("✓ 找到LaTeX引擎: {}".format(', '.join(found_engines)))
+        engines_str = ', '.join(found_engines)
+        print(f"✓ 找到LaTeX引擎: {engines_str}", file=out)
         return True
     else:
-        print("⚠ 未找到LaTeX引擎，PDF生成功能可能不可用")
-        print("  建议安装TeX Live、MiKTeX或其他LaTeX发行版")
+        print("⚠ 未找到LaTeX引擎，PDF生成功能可能不可用", file=out)
+        print("  建议安装TeX Live、MiKTeX或其他LaTeX发行版", file=out)
         return False
 
-def create_config():
+def _fast_copy(src, dst):
+    """复制文件，Linux上使用os.sendfile在内核中完成，其他平台回退到shutil.copyfile"""
+    try:
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            src_st = os.fstat(src_fd)
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                offset = 0
+                remaining = src_st.st_size
+                while remaining > 0:
+                    sent = os.sendfile(dst_fd, src_fd, offset, remaining)
+                    if sent == 0:
+                        # 部分文件系统会提前返回0，从已复制的位置起改为普通读写复制剩余部分
+                        os.lseek(src_fd, offset, os.SEEK_SET)
+                        with open(src_fd, 'rb', closefd=False) as fsrc, \
+                                open(dst_fd, 'wb', closefd=False) as fdst:
+                            shutil.copyfileobj(fsrc, fdst)
+                        break
+                    offset += sent
+                    remaining -= sent
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    except (AttributeError, OSError):
+        # 不支持sendfile的平台或文件系统
+        shutil.copyfile(src, dst)
+        src_st = os.stat(src)
+    os.chmod(dst, stat.S_IMODE(src_st.st_mode))
+
+def _scan_cwd():
+    """一次性读取当前目录，返回 {文件名: DirEntry}"""
+    with os.scandir(".") as it:
+        return {entry.name: entry for entry in it}
+
+def _confirm_overwrite(config_file):
+    """配置文件已存在时询问是否覆盖，非交互环境中默认不覆盖"""
+    if not _is_interactive():
+        print("  跳过配置文件创建（非交互环境）")
+        return False
+    try:
+        overwrite = input(f"  {config_file} 已存在，是否覆盖? (y/N): ").strip().lower()
+    except EOFError:
+        overwrite = ''
+    if overwrite != 'y':
+        print("  跳过配置文件创建")
+        return False
+    return True
+
+def create_config(entries=None):
     """创建配置文件"""
     print("\n创建配置文件...")
     
     config_file = "config.env"
     config_example = "config.env.example"
+    entries = _scan_cwd() if entries is None else entries
     
-    if os.path.exists(config_file):
-        try:
-            overwrite = input("  {} 已存在，是否覆盖? (y/N): ".format(config_file)).strip().lower()
-            if overwrite != 'y':
-                print("  跳过配置文件创建")
-                return True
-        except:
-            # 在非交互环境中，默认不覆盖
-            print("  跳过配置文件创建（非交互环境）")
-            return True
+    # 示例文件不存在时无需占位config.env
+    example_entry = entries.get(config_example)
+    if example_entry is None or not example_entry.is_file():
+        print(f"✗ 配置示例文件 {config_example} 不存在")
+        return False
     
-    if os.path.exists(config_example):
+    # 已存在的配置文件在目录扫描结果中即可看到，无需先创建占位文件
+    exists = config_file in entries
+    if exists and not _confirm_overwrite(config_file):
+        return True
+    
+    # 先写入同目录下的临时文件再放到config.env，中断时不会留下空的或不完整的config.env
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=".", prefix=config_file + ".", suffix=".tmp")
+    os.close(tmp_fd)
+    try:
+        _fast_copy(config_example, tmp_path)
+        if exists:
+            os.replace(tmp_path, config_file)
+        else:
+            try:
+                # 硬链接在目标已存在时失败，不会覆盖扫描之后才出现的配置文件
+                os.link(tmp_path, config_file)
+            except FileExistsError:
+                if not _confirm_overwrite(config_file):
+                    return True
+                os.replace(tmp_path, config_file)
+            except OSError:
+                # 文件系统不支持硬链接
+                os.replace(tmp_path, config_file)
+        print(f"✓ 已从 {config_example} 创建 {config_file}")
+        return True
+    except FileNotFoundError:
+        print(f"✗ 配置示例文件 {config_example} 不存在")
+    except Exception as e:
+        print(f"✗ 创建配置文件失败: {e}")
+    finally:
         try:
-            shutil.copy(config_example, config_file)
-            print("✓ 已从 {} 创建 {}".format(config_example, config_file))
-            return True
-        except Exception as e:
-            print("✗ 创建配置文件失败: {}".format(str(e)))
-            return False
-    else:
-        print("✗ 配置示例文件 {} 不存在".format(config_example))
-        return False
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+    return False
 
 def create_directories():
     """创建必要的目录"""
@@ -109,66 +360,126 @@ def create_directories():
     
     directories = ["outputs", "temp", "logs"]
     
+    # 均为单层目录，直接mkdir并忽略已存在的情况，省去makedirs的额外isdir检查
     for directory in directories:
         try:
-            os.makedirs(directory, exist_ok=True)
-            print("✓ 创建目录: {}".format(directory))
-        except Exception as e:
-            print("✗ 创建目录 {} 失败: {}".format(directory, str(e)))
+            os.mkdir(directory, 0o755)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            print(f"✗ 创建目录 {directory} 失败: {e}")
             return False
+        print(f"✓ 创建目录: {directory}")
     
     return True
 
-def run_tests():
+def _run_tests_in_process(test_file):
+    """在当前解释器中加载并运行测试脚本，返回退出码
+    
+    测试脚本无法加载（ImportError/SyntaxError），或既没有main()也无法使用pytest时抛出异常，
+    由调用方改为在子进程中运行；测试运行过程中的异常视为测试失败。
+    """
+    spec = importlib.util.spec_from_file_location("test_plugin", test_file)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"无法加载 {test_file}")
+    module = importlib.util.module_from_spec(spec)
+    
+    # 与单独运行时一致：测试脚本可按模块名找到自身，sys.argv中不含本脚本的参数
+    argv = sys.argv
+    sys.argv = [test_file]
+    sys.modules[spec.name] = module
+    try:
+        try:
+            spec.loader.exec_module(module)
+        except (ImportError, SyntaxError):
+            del sys.modules[spec.name]
+            raise
+        
+        main = getattr(module, "main", None)
+        if main is None:
+            import pytest
+            main = lambda: pytest.main([test_file])
+        
+        try:
+            return main()
+        except SystemExit as e:
+            return e.code
+        except Exception as e:
+            print(f"✗ 测试运行异常: {e}")
+            return 1
+    finally:
+        sys.argv = argv
+
+def _run_tests_subprocess(test_file):
+    """在子进程中运行测试脚本，返回退出码，超时返回None"""
+    # 子进程输出逐行转发，测试进度实时可见，且无需在内存中缓冲全部输出
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    proc = subprocess.Popen(
+        [sys.executable, test_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        env=env
+    )
+    
+    timed_out = threading.Event()
+    
+    def kill_on_timeout():
+        timed_out.set()
+        proc.kill()
+    
+    timer = threading.Timer(120, kill_on_timeout)
+    timer.start()
+    try:
+        for line in proc.stdout:
+            sys.stdout.write(line)
+        proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    
+    if timed_out.is_set():
+        return None
+    return proc.returncode
+
+def run_tests(entries=None):
     """运行测试"""
     print("\n运行插件测试...")
     
     test_file = "test_plugin.py"
+    entries = _scan_cwd() if entries is None else entries
     
-    if not os.path.exists(test_file):
-        print("✗ 测试文件 {} 不存在".format(test_file))
+    test_entry = entries.get(test_file)
+    if test_entry is None or not test_entry.is_file():
+        print(f"✗ 测试文件 {test_file} 不存在")
         return False
     
+    # 优先在当前解释器中运行，省去再启动一个Python进程的开销
     try:
-        result = subprocess.run(
-            [sys.executable, test_file],
-            capture_output=True,
-            text=True,
-            timeout=120
-        )
-        
-        if result.returncode == 0:
-            print("✓ 所有测试通过")
-            return True
-        else:
-            print("✗ 部分测试失败")
-            print(result.stdout)
-            return False
-    except subprocess.TimeoutExpired:
+        try:
+            returncode = _run_tests_in_process(test_file)
+        except (ImportError, SyntaxError) as e:
+            # 当前解释器中无法加载时不算测试失败，改为在子进程中运行
+            print(f"  无法在当前进程中加载测试({e})，改为在子进程中运行")
+            returncode = _run_tests_subprocess(test_file)
+    except Exception as e:
+        print(f"✗ 运行测试失败: {e}")
+        return False
+    
+    if returncode is None:
         print("✗ 测试超时")
         return False
-    except Exception as e:
-        print("✗ 运行测试失败: {}".format(str(e)))
+    if returncode == 0:
+        print("✓ 所有测试通过")
+        return True
+    else:
+        print("✗ 部分测试失败")
         return False
 
 def print_usage_info():
     """打印使用信息"""
-    print("\n" + "="*50)
-    print("安装完成！")
-    print("="*50)
-    print("\n使用说明:")
-    print("1. 确保分布式服务器已启动")
-    print("2. 插件将自动注册到VCP系统")
-    print("3. AI可以使用以下命令调用插件:")
-    print("   - ConvertFile: 转换单个文件")
-    print("   - BatchConvert: 批量转换文件")
-    print("   - ConvertFromContent: 从内容转换")
-    print("   - DetectFormat: 检测文件格式")
-    print("   - GetSupportedFormats: 获取支持格式")
-    print("\n配置文件: config.env")
-    print("输出目录: outputs/")
-    print("临时文件: temp/")
-    print("\n更多信息请参考 README.md")
+    sys.stdout.write(USAGE_INFO)
 
 def main():
     """主函数"""
@@ -179,15 +490,25 @@ def main():
     if not check_python_version():
         return 1
     
-    # 检查Pandoc
-    if not check_pandoc():
+    # 并行检查Pandoc和LaTeX（可选），输出先缓冲再按固定顺序打印
+    pandoc_out = io.StringIO()
+    latex_out = io.StringIO()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pandoc_future = executor.submit(check_pandoc, pandoc_out)
+        latex_future = executor.submit(check_latex, latex_out)
+        pandoc_ok = pandoc_future.result()
+        latex_future.result()
+    
+    sys.stdout.write(pandoc_out.getvalue())
+    if not pandoc_ok:
         return 1
+    sys.stdout.write(latex_out.getvalue())
     
-    # 检查LaTeX（可选）
-    check_latex()
+    # 读取一次插件目录，后续的文件存在性检查都基于这份快照
+    entries = _scan_cwd()
     
     # 创建配置文件
-    if not create_config():
+    if not create_config(entries):
         return 1
     
     # 创建目录
@@ -195,12 +516,15 @@ def main():
         return 1
     
     # 运行测试
-    try:
-        run_test = input("\n是否运行插件测试? (Y/n): ").strip().lower()
+    if _is_interactive():
+        try:
+            run_test = input("\n是否运行插件测试? (Y/n): ").strip().lower()
+        except EOFError:
+            run_test = 'n'
         if run_test != 'n':
-            if not run_tests():
+            if not run_tests(entries):
                 print("⚠ 测试未完全通过，插件可能无法正常工作")
-    except:
+    else:
         # 在非交互环境中，默认不运行测试
         print("\n跳过测试（非交互环境）")
     
